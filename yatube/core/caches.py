@@ -0,0 +1,43 @@
+from django.core.exceptions import ImproperlyConfigured
+
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'db': 'django.core.cache.backends.db.DatabaseCache',
+    'memcached': 'django.core.cache.backends.memcached.MemcachedCache',
+    'redis': 'django_redis.cache.RedisCache',
+}
+
+DEFAULT_LOCATIONS = {
+    'locmem': '',
+    'db': 'yatube_cache',
+    'memcached': '127.0.0.1:11211',
+    'redis': 'redis://127.0.0.1:6379/1',
+}
+
+
+def cache_settings(backend, location=None, key_prefix=''):
+    """Собирает настройку кэша по короткому имени бэкенда.
+
+    locmem — свой кэш в каждом процессе; file и db (таблица
+    в основной базе, создаётся командой createcachetable) — общие
+    для процессов на одной машине; memcached и redis — для нескольких
+    машин, требуют пакетов python-memcached и django-redis.
+    """
+    if backend not in CACHE_BACKENDS:
+        raise ImproperlyConfigured(
+            f'Неизвестный бэкенд кэша {backend!r}, '
+            f'доступны: {", ".join(CACHE_BACKENDS)}'
+        )
+    location = location or DEFAULT_LOCATIONS.get(backend)
+    if not location:
+        if backend == 'file':
+            raise ImproperlyConfigured(
+                'Для файлового кэша нужно указать каталог'
+            )
+        location = ''
+    return {
+        'BACKEND': CACHE_BACKENDS[backend],
+        'LOCATION': location,
+        'KEY_PREFIX': key_prefix,
+    }
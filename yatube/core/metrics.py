@@ -0,0 +1,103 @@
+import threading
+from bisect import bisect_left
+
+# Границы корзин по умолчанию — как у клиентов Prometheus.
+SECONDS_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+QUERIES_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+
+class Histogram:
+    """Гистограмма значений метрики с разбивкой по метке view."""
+
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, view, value):
+        series = self.series.get(view)
+        if series is None:
+            series = self.series[view] = {
+                'buckets': [0] * (len(self.buckets) + 1), 'sum': 0, 'count': 0,
+            }
+        series['buckets'][bisect_left(self.buckets, value)] += 1
+        series['sum'] += value
+        series['count'] += 1
+
+    def render(self):
+        yield f'# HELP {self.name} {self.description}'
+        yield f'# TYPE {self.name} histogram'
+        for view, series in sorted(self.series.items()):
+            label = escape(view)
+            total = 0
+            bounds = [*self.buckets, '+Inf']
+            for bound, count in zip(bounds, series['buckets']):
+                total += count
+                yield (
+                    f'{self.name}_bucket{{view="{label}",le="{bound}"}} '
+                    f'{total}'
+                )
+            yield f'{self.name}_sum{{view="{label}"}} {series["sum"]}'
+            yield f'{self.name}_count{{view="{label}"}} {series["count"]}'
+
+
+def escape(value):
+    """Экранирует значение метки для текстового формата Prometheus."""
+    return (
+        value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    )
+
+
+class Registry:
+    """Метрики запросов процесса.
+
+    Каждый процесс веб-сервера копит свои значения: при нескольких
+    процессах Prometheus суммирует их по отдельным экземплярам.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {
+            'latency': Histogram(
+                'yatube_request_duration_seconds',
+                'Время обработки запроса.', SECONDS_BUCKETS,
+            ),
+            'sql_time': Histogram(
+                'yatube_sql_duration_seconds',
+                'Суммарное время SQL-запросов за запрос.', SECONDS_BUCKETS,
+            ),
+            'template_time': Histogram(
+                'yatube_template_duration_seconds',
+                'Время отрисовки шаблонов за запрос.', SECONDS_BUCKETS,
+            ),
+            'queries': Histogram(
+                'yatube_sql_queries',
+                'Количество SQL-запросов за запрос.', QUERIES_BUCKETS,
+            ),
+        }
+
+    def observe(self, view, **values):
+        with self.lock:
+            for name, value in values.items():
+                self.histograms[name].observe(view, value)
+
+    def render(self):
+        """Метрики в текстовом формате Prometheus."""
+        with self.lock:
+            lines = [
+                line
+                for histogram in self.histograms.values()
+                for line in histogram.render()
+            ]
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self.lock:
+            for histogram in self.histograms.values():
+                histogram.series.clear()
+
+
+registry = Registry()
@@ -0,0 +1,99 @@
+import random
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import Template
+
+from .metrics import registry
+
+# Замер текущего запроса; None — запрос не попал в выборку.
+current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        """Обёртка execute_wrapper: считает запросы и их время."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - started
+            self.queries += 1
+
+
+def _timed_render(render):
+    """Учитывает время отрисовки шаблона в замере запроса.
+    Вложенные отрисовки уже входят во внешнюю и не считаются повторно.
+    """
+    def timed_render(self, *args, **kwargs):
+        metrics = current.get()
+        if metrics is None:
+            return render(self, *args, **kwargs)
+        metrics.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            metrics.template_depth -= 1
+            if not metrics.template_depth:
+                metrics.template_time += time.perf_counter() - started
+    timed_render.timed = True
+    return timed_render
+
+
+class InstrumentationMiddleware:
+    """Замеряет у доли запросов INSTRUMENTATION_SAMPLE_RATE число
+    и время SQL-запросов, время отрисовки шаблонов и общее время
+    ответа. Замер попадает в гистограммы по имени view (см. core.views
+    metrics) и, если включено INSTRUMENTATION_SERVER_TIMING,
+    в заголовок Server-Timing.
+
+    Запросы вне выборки проходят без обёрток: при нулевой доле
+    middleware стоит одного сравнения.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if not getattr(Template.render, 'timed', False):
+            Template.render = _timed_render(Template.render)
+
+    def __call__(self, request):
+        rate = settings.INSTRUMENTATION_SAMPLE_RATE
+        if rate <= 0 or (rate < 1 and random.random() >= rate):
+            return self.get_response(request)
+        metrics = RequestMetrics()
+        token = current.set(metrics)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            current.reset(token)
+        latency = time.perf_counter() - started
+        match = request.resolver_match
+        registry.observe(
+            match.view_name if match else '<unresolved>',
+            latency=latency,
+            sql_time=metrics.sql_time,
+            template_time=metrics.template_time,
+            queries=metrics.queries,
+        )
+        if settings.INSTRUMENTATION_SERVER_TIMING:
+            response['Server-Timing'] = ', '.join((
+                f'db;desc="{metrics.queries} queries";'
+                f'dur={metrics.sql_time * 1000:.1f}',
+                f'tpl;dur={metrics.template_time * 1000:.1f}',
+                f'total;dur={latency * 1000:.1f}',
+            ))
+        return response
@@ -0,0 +1,112 @@
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from .caches import cache_settings
+from .metrics import registry
+
+TEMP_CACHE_DIR = tempfile.mkdtemp()
+
+
+class CacheSettingsTests(TestCase):
+    def test_cache_settings_backends(self):
+        """Короткое имя бэкенда превращается в настройку кэша."""
+        self.assertEqual(
+            cache_settings('file', TEMP_CACHE_DIR)['BACKEND'],
+            'django.core.cache.backends.filebased.FileBasedCache',
+        )
+        self.assertEqual(
+            cache_settings('redis')['LOCATION'], 'redis://127.0.0.1:6379/1',
+        )
+        for backend in ('unknown', 'file'):
+            with self.subTest(backend=backend):
+                with self.assertRaises(ImproperlyConfigured):
+                    cache_settings(backend)
+
+
+@override_settings(CACHES={'default': cache_settings('file', TEMP_CACHE_DIR)})
+class SharedCacheTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_CACHE_DIR, ignore_errors=True)
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def test_file_cache_is_shared_between_processes(self):
+        """Независимые экземпляры файлового кэша (как в разных
+        процессах) видят записи друг друга.
+        """
+        first = FileBasedCache(TEMP_CACHE_DIR, {})
+        second = FileBasedCache(TEMP_CACHE_DIR, {})
+        first.set('shared', 'value')
+        self.assertEqual(second.get('shared'), 'value')
+
+    def test_index_page_cached_in_shared_cache(self):
+        """Главная страница кэшируется в общем файловом кэше."""
+        self.client.get(reverse('posts:index'))
+        other_process_cache = FileBasedCache(TEMP_CACHE_DIR, {})
+        self.assertTrue(other_process_cache._list_cache_files())
+
+
+@override_settings(INSTRUMENTATION_METRICS_TOKEN='metrics-token')
+class InstrumentationMiddlewareTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.clear()
+
+    def get_metrics(self, token='metrics-token'):
+        return self.client.get(
+            reverse('metrics'), HTTP_AUTHORIZATION=f'Bearer {token}',
+        )
+
+    @override_settings(INSTRUMENTATION_SAMPLE_RATE=1)
+    def test_sampled_request_is_measured(self):
+        """Замер запроса попадает в заголовок Server-Timing
+        и в гистограммы страницы метрик.
+        """
+        response = self.client.get(reverse('posts:index'))
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'^db;desc="[1-9]\d* queries";dur=[\d.]+, ')
+        self.assertIn('tpl;dur=', timing)
+        self.assertIn('total;dur=', timing)
+        metrics = self.get_metrics().content.decode()
+        self.assertIn(
+            'yatube_request_duration_seconds_count{view="posts:index"} 1',
+            metrics,
+        )
+        self.assertIn(
+            'yatube_sql_queries_bucket{view="posts:index",le="+Inf"} 1',
+            metrics,
+        )
+
+    @override_settings(INSTRUMENTATION_SAMPLE_RATE=0)
+    def test_unsampled_request_is_not_measured(self):
+        """Без выборки запросы не замеряются."""
+        response = self.client.get(reverse('posts:index'))
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertNotIn('posts:index', self.get_metrics().content.decode())
+
+    def test_metrics_require_token_or_staff(self):
+        """Метрики видны только по токену и сотрудникам, даже
+        с локального адреса (за обратным прокси).
+        """
+        self.assertEqual(
+            self.client.get(reverse('metrics')).status_code, 404,
+        )
+        self.assertEqual(self.get_metrics('wrong').status_code, 404)
+        self.assertEqual(self.get_metrics().status_code, 200)
+        staff = get_user_model().objects.create_user(
+            username='MetricsStaff', is_staff=True,
+        )
+        self.client.force_login(staff)
+        self.assertEqual(
+            self.client.get(reverse('metrics')).status_code, 200,
+        )
@@ -1,4 +1,9 @@
+from django.conf import settings
+from django.http import Http404, HttpResponse
 from django.shortcuts import render
+from django.utils.crypto import constant_time_compare
+
+from .metrics import registry
 
 
 def page_not_found(request, exception):
@@ -11,3 +16,20 @@ def csrf_failure(request, reason=''):
 
 def custom_failure(request, reason=''):
     return render(request, 'core/500.html')
+
+
+def metrics(request):
+    """Гистограммы InstrumentationMiddleware в формате Prometheus.
+    Доступны сотрудникам и по токену INSTRUMENTATION_METRICS_TOKEN
+    в заголовке Authorization: Bearer.
+    """
+    token = settings.INSTRUMENTATION_METRICS_TOKEN
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    allowed = request.user.is_staff or bool(token) and constant_time_compare(
+        authorization, f'Bearer {token}',
+    )
+    if not allowed:
+        raise Http404
+    return HttpResponse(
+        registry.render(), content_type='text/plain; version=0.0.4',
+    )
@@ -1,12 +1,58 @@
+from django import forms
 from django.contrib import admin
+from django.contrib.admin.views.main import PAGE_VAR
+from django.contrib.admin.widgets import AutocompleteSelect
 
 from .models import Group, Post, Follow, Comment
+from .search import get_backend, parse_query
+from .utils import EstimatedCountPaginator
+
+
+class LoadedAutocompleteSelect(AutocompleteSelect):
+    """Автодополнение, которое берёт выбранное значение из уже
+    загруженного объекта (selected), а не отдельным запросом.
+    """
+
+    selected = None
+
+    def optgroups(self, name, value, attr=None):
+        selected = self.selected
+        if selected is None or [str(v) for v in value] != [str(selected.pk)]:
+            return super().optgroups(name, value, attr)
+        default = (None, [], 0)
+        if not self.is_required:
+            default[1].append(self.create_option(name, '', '', False, 0))
+        label = self.choices.field.label_from_instance(selected)
+        default[1].append(self.create_option(
+            name, selected.pk, label, True, len(default[1]),
+        ))
+        return [default]
+
+
+class PostChangeListForm(forms.ModelForm):
+    """Форма строки списка постов: группа уже загружена вместе
+    с постом (list_select_related), поэтому строка не делает запросов.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        field = self.fields.get('group')
+        if field is None:
+            return
+        widget = getattr(field.widget, 'widget', field.widget)
+        if isinstance(widget, LoadedAutocompleteSelect):
+            widget.selected = self.instance.group
 
 
 @admin.register(Post)
 class PostAdmin(admin.ModelAdmin):
     """Настраивает отображение моделей
     постов и групп в интерфейсе администратора.
+
+    Рассчитан на большие таблицы: автор и группа загружаются одним
+    запросом со списком, группа выбирается автодополнением, полное
+    количество постов не считается, а иерархия дат и фильтр по дате
+    опираются на индекс по pub_date.
     """
 
     list_display = (
@@ -16,12 +62,60 @@ class PostAdmin(admin.ModelAdmin):
         'author',
         'group',
     )
+    list_select_related = ('author', 'group')
     search_fields = ('text',)
     list_filter = ('pub_date',)
+    date_hierarchy = 'pub_date'
     empty_value_display = '-пусто-'
     list_editable = ('group',)
+    autocomplete_fields = ('author', 'group')
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+
+    def get_paginator(self, request, queryset, per_page, orphans=0,
+                      allow_empty_first_page=True):
+        """Paginator знает запрошенную страницу: количество считается
+        до неё и ещё на POSTS_ADMIN_COUNT_LIMIT записей дальше.
+        """
+        try:
+            page = int(request.GET.get(PAGE_VAR, 0)) + 1
+        except ValueError:
+            page = 1
+        return self.paginator(
+            queryset, per_page, orphans, allow_empty_first_page, page=page,
+        )
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name in self.get_autocomplete_fields(request):
+            kwargs.setdefault('widget', LoadedAutocompleteSelect(
+                db_field.remote_field, self.admin_site,
+                using=kwargs.get('using'),
+            ))
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def get_changelist_form(self, request, **kwargs):
+        kwargs.setdefault('form', PostChangeListForm)
+        return super().get_changelist_form(request, **kwargs)
+
+    def get_search_results(self, request, queryset, search_term):
+        """Ищет по индексу полнотекстового поиска, а не LIKE
+        по всей таблице.
+        """
+        terms = parse_query(search_term)
+        if not terms:
+            return queryset, False
+        return get_backend().filter(queryset, terms), False
+
+
+@admin.register(Group)
+class GroupAdmin(admin.ModelAdmin):
+    """Группы ищутся по названию и slug — для автодополнения
+    в форме поста.
+    """
+
+    list_display = ('pk', 'title', 'slug')
+    search_fields = ('title', 'slug')
 
 
-admin.site.register(Group)
 admin.site.register(Follow)
 admin.site.register(Comment)
@@ -0,0 +1,155 @@
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.utils.cache import patch_cache_control
+from django.views.decorators.cache import cache_page
+
+COUNT_CACHE_PREFIX = 'posts:count'
+LISTING_VERSION_PREFIX = 'posts:listing'
+ALL_LISTINGS = 'all'
+POST_CARD_FRAGMENT = 'post_card'
+POST_CARD_VIEWS = (
+    'posts:index',
+    'posts:group_list',
+    'posts:profile',
+    'posts:follow_index',
+    'posts:search',
+)
+
+
+def count_cache_key(scope):
+    """Ключ кэша с количеством постов в ленте: index, group:<id>
+    или author:<id>.
+    """
+    return f'{COUNT_CACHE_PREFIX}:{scope}'
+
+
+def get_cached_count(scope, compute):
+    """Отдаёт количество постов ленты из кэша, при промахе
+    вычисляет его функцией compute и сохраняет.
+    """
+    key = count_cache_key(scope)
+    count = cache.get(key)
+    if count is None:
+        count = compute()
+        cache.set(key, count, settings.POSTS_COUNT_CACHE_TIMEOUT)
+    return count
+
+
+def invalidate_counts(*scopes):
+    """Сбрасывает закэшированные количества постов указанных лент."""
+    cache.delete_many([count_cache_key(scope) for scope in scopes])
+
+
+def post_count_scopes(post, group_ids=()):
+    """Ленты, в которые попадает пост: общая, автора и групп."""
+    scopes = ['index', f'author:{post.author_id}']
+    scopes.extend(
+        f'group:{group_id}' for group_id in group_ids if group_id is not None
+    )
+    return scopes
+
+
+def _listing_version_key(scope):
+    return f'{LISTING_VERSION_PREFIX}:{scope}'
+
+
+def _new_version():
+    """Новая версия строится от текущего времени, поэтому после
+    вытеснения ключа версии из кэша старые страницы не оживут.
+    """
+    return int(time.time() * 1000000)
+
+
+def listing_versions(*scopes):
+    """Отдаёт текущие версии лент одним запросом к кэшу."""
+    keys = {_listing_version_key(scope): scope for scope in scopes}
+    versions = cache.get_many(keys)
+    missing = {key: _new_version() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def bump_listings(*scopes):
+    """Меняет версии лент, после чего их закэшированные страницы
+    больше не используются.
+    """
+    for scope in set(scopes):
+        key = _listing_version_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _new_version(), None)
+
+
+def post_listing_scopes(post, group_slugs=()):
+    """Ленты, на страницах которых показывается пост."""
+    scopes = ['index', f'profile:{post.author.username}']
+    scopes.extend(f'group:{slug}' for slug in group_slugs)
+    return scopes
+
+
+def cache_listing(scope):
+    """Кэширует ленту до изменения её версии.
+
+    scope — функция, которая по аргументам view отдаёт имя ленты.
+    В ключ входят версии ленты и всех лент сразу, поэтому сигналы
+    об изменении постов, групп и подписок сбрасывают кэш без ожидания
+    таймаута. Анонимам отдаётся закэшированная страница целиком.
+    Для вошедших пользователей страница собирается заново: шапка
+    и кнопка подписки рисуются под пользователя, а общий для всех
+    список постов берётся из фрагмента {% cache %} с ключом
+    request.listing_key. Браузерам и прокси страница кэшировать
+    не разрешается.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            name = scope(**kwargs)
+            version, all_version = listing_versions(name, ALL_LISTINGS)
+            request.listing_key = f'{name}:{version}:{all_version}'
+            request.listing_timeout = settings.POSTS_LISTING_CACHE_TIMEOUT
+            if request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+            cached_view = cache_page(
+                request.listing_timeout, key_prefix=request.listing_key,
+            )(view)
+            response = cached_view(request, *args, **kwargs)
+            # cache_page разрешает браузерам и прокси хранить страницу
+            # весь таймаут, а смена версии сбрасывает только свой кэш.
+            del response['Expires']
+            patch_cache_control(response, max_age=0)
+            return response
+        return wrapper
+    return decorator
+
+
+def cards_version(request):
+    """Версия всех лент для ключа карточки поста: карточка показывает
+    автора и группу, поэтому их изменение (сигналы бьют ALL_LISTINGS)
+    должно сбрасывать и карточки. Запоминается на время запроса.
+    """
+    if not hasattr(request, 'cards_version'):
+        request.cards_version, = listing_versions(ALL_LISTINGS)
+    return request.cards_version
+
+
+def invalidate_post_card(post_id, updated, group_id=None):
+    """Удаляет закэшированные карточки поста с отметкой изменения
+    updated во всех лентах (см. posts/includes/post_card.html).
+    """
+    group_pks = ('', group_id) if group_id else ('',)
+    version, = listing_versions(ALL_LISTINGS)
+    cache.delete_many([
+        make_template_fragment_key(
+            POST_CARD_FRAGMENT,
+            [post_id, updated, view_name, group_pk, version],
+        )
+        for view_name in POST_CARD_VIEWS
+        for group_pk in group_pks
+    ])
@@ -0,0 +1,120 @@
+from collections import defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import Q
+
+from .models import FeedItem, Follow, Post, UserStats
+
+
+def is_pulled(author_id):
+    """Посты авторов с огромным числом подписчиков не раскладываются
+    по лентам, а подтягиваются при чтении ленты.
+    """
+    return UserStats.objects.filter(
+        user_id=author_id,
+        followers_count__gt=settings.POSTS_FEED_FANOUT_LIMIT,
+    ).exists()
+
+
+def _feed_items(user_ids, post):
+    return (
+        FeedItem(
+            user_id=user_id,
+            post_id=post.pk,
+            author_id=post.author_id,
+            pub_date=post.pub_date,
+        )
+        for user_id in user_ids
+    )
+
+
+def _insert(items):
+    """Вставляет записи пачками по POSTS_FEED_BATCH_SIZE. Явный
+    batch_size в bulk_create Django не ограничивает лимитами SQLite,
+    поэтому пачки режутся здесь, а bulk_create делит их сам.
+    """
+    items = iter(items)
+    while True:
+        batch = list(islice(items, settings.POSTS_FEED_BATCH_SIZE))
+        if not batch:
+            return
+        FeedItem.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def fan_out(post):
+    """Раскладывает новый пост по лентам подписчиков автора."""
+    if is_pulled(post.author_id):
+        return
+    followers = Follow.objects.filter(
+        author_id=post.author_id
+    ).values_list('user_id', flat=True)
+    _insert(_feed_items(followers.iterator(), post))
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту нового подписчика последние посты автора."""
+    if is_pulled(author_id):
+        return
+    posts = Post.objects.filter(author_id=author_id).only(
+        'pk', 'author_id', 'pub_date'
+    )[:settings.POSTS_FEED_BACKFILL]
+    _insert(
+        item
+        for post in posts
+        for item in _feed_items((user_id,), post)
+    )
+
+
+def backfill_many(pairs):
+    """Заполняет ленты многих новых подписок (user_id, author_id):
+    последние посты каждого автора читаются один раз для всех его
+    новых подписчиков.
+    """
+    followers = defaultdict(list)
+    for user_id, author_id in pairs:
+        followers[author_id].append(user_id)
+    for author_id, user_ids in followers.items():
+        if is_pulled(author_id):
+            continue
+        posts = Post.objects.filter(author_id=author_id).only(
+            'pk', 'author_id', 'pub_date'
+        )[:settings.POSTS_FEED_BACKFILL]
+        _insert(
+            item
+            for post in posts
+            for item in _feed_items(user_ids, post)
+        )
+
+
+def prune(user_id, author_id):
+    """Убирает из ленты посты автора, от которого пользователь
+    отписался.
+    """
+    FeedItem.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def get_feed(user):
+    """Отдаёт ленту подписок пользователя.
+
+    Если пользователь не подписан на авторов с огромным числом
+    подписчиков, лента — это одно чтение его записей FeedItem.
+    Иначе к ним по подзапросу добавляются посты таких авторов.
+    """
+    pulled_authors = Follow.objects.filter(
+        user=user,
+        author__stats__followers_count__gt=settings.POSTS_FEED_FANOUT_LIMIT,
+    ).values_list('author_id', flat=True)
+    if not pulled_authors.exists():
+        return FeedItem.objects.filter(user=user).select_related(
+            'post__author', 'post__group'
+        )
+    pushed_posts = FeedItem.objects.filter(user=user).values('post_id')
+    return Post.objects.filter(
+        Q(pk__in=pushed_posts) | Q(author_id__in=pulled_authors)
+    ).select_related('author', 'group')
+
+
+def unwrap_post(item):
+    """Пост записи ленты; посты подтянутых авторов отдаются как есть."""
+    return item.post if isinstance(item, FeedItem) else item
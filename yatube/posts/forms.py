@@ -1,15 +1,55 @@
 from django import forms
+from django.conf import settings
+from django.template.defaultfilters import filesizeformat
 
 from .models import Post, Comment
 
+UPLOAD_ERRORS = {
+    'file_too_large': 'Размер файла не должен превышать %(max_size)s.',
+    'invalid_image': (
+        'Загрузите правильное изображение. Файл, который вы загрузили, '
+        'поврежден или не является изображением.'
+    ),
+}
+
 
 class PostForm(forms.ModelForm):
-    """Форма для публикации новых постов и редактирования существующих."""
+    """Форма для публикации новых постов и редактирования существующих.
+
+    Изображение, отклонённое при загрузке (uploads.ImageUploadHandler),
+    не передаётся полю, а превращается в ошибку в clean_image.
+    """
 
     class Meta:
         model = Post
         fields = ('text', 'group', 'image')
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.upload_error = getattr(self.files.get('image'), 'error', None)
+        if self.upload_error:
+            self.files = self.files.copy()
+            del self.files['image']
+
+    def clean_image(self):
+        image = self.cleaned_data['image']
+        error = self.upload_error
+        if error is None and image and 'image' in self.files and (
+            image.size > settings.POSTS_IMAGE_MAX_SIZE
+        ):
+            error = 'file_too_large'
+        if error:
+            raise forms.ValidationError(
+                UPLOAD_ERRORS[error],
+                code=error,
+                params={
+                    'max_size': filesizeformat(
+                        settings.POSTS_IMAGE_MAX_SIZE
+                    ),
+                },
+            )
+        return image
+
 
 class CommentForm(forms.ModelForm):
     """Форма для публикации новых комментариев."""
@@ -0,0 +1,164 @@
+import io
+import math
+from collections import namedtuple
+
+from PIL import Image, UnidentifiedImageError
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - нет на Windows
+    resource = None
+
+ORIENTATION_TAG = 0x0112
+# Значения EXIF Orientation, при которых изображение повёрнуто на 90°.
+ROTATED_ORIENTATIONS = (5, 6, 7, 8)
+# Преобразования, возвращающие изображение в исходную ориентацию
+# (как в ImageOps.exif_transpose).
+TRANSPOSITIONS = {
+    2: Image.FLIP_LEFT_RIGHT,
+    3: Image.ROTATE_180,
+    4: Image.FLIP_TOP_BOTTOM,
+    5: Image.TRANSPOSE,
+    6: Image.ROTATE_270,
+    7: Image.TRANSVERSE,
+    8: Image.ROTATE_90,
+}
+
+Target = namedtuple(
+    'Target', 'width height crop upscale format quality progressive',
+)
+
+
+class ImageRejected(Exception):
+    """Изображение не прошло проверку и не обрабатывается."""
+
+
+def init_worker(memory_limit, max_pixels):
+    """Настраивает процесс пула: ограничивает его адресное пространство
+    memory_limit байтами и число пикселей изображения.
+    """
+    if memory_limit and resource is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    Image.MAX_IMAGE_PIXELS = max_pixels
+
+
+def open_image(source, max_pixels):
+    """Открывает изображение, читая только заголовок, и проверяет
+    число пикселей до декодирования. Формат не ограничивается:
+    принимается всё, что открывает Pillow, как и в ImageField
+    (в том числе MPO — так Pillow называет JPEG с камер телефонов).
+    Ошибки чтения файла
+    (нет файла, нет доступа) не считаются отказом и пробрасываются.
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    try:
+        image = Image.open(source)
+    except (UnidentifiedImageError, Image.DecompressionBombError) as error:
+        raise ImageRejected(str(error)) from error
+    width, height = image.size
+    if max_pixels and width * height > max_pixels:
+        image.close()
+        raise ImageRejected(
+            f'Изображение {width}x{height} больше {max_pixels} пикселей'
+        )
+    return image
+
+
+def _scale(size, target):
+    width, height = size
+    ratios = (target.width / width, target.height / height)
+    scale = max(ratios) if target.crop else min(ratios)
+    if not target.upscale:
+        scale = min(scale, 1)
+    return scale
+
+
+def _draft(image, targets, orientation):
+    """Просит декодер JPEG сразу уменьшить изображение (в 2, 4 или 8
+    раз), но не меньше, чем нужно самой крупной миниатюре.
+    """
+    width, height = image.size
+    if orientation in ROTATED_ORIENTATIONS:
+        targets = [
+            target._replace(width=target.height, height=target.width)
+            for target in targets
+        ]
+    scale = max(_scale((width, height), target) for target in targets)
+    if scale < 1:
+        image.draft(image.mode, (
+            math.ceil(width * scale), math.ceil(height * scale),
+        ))
+
+
+def _normalize(image, orientation):
+    """Поворачивает по EXIF и приводит к режиму, который умеют
+    масштабировать и сохранять все форматы.
+    """
+    if orientation in TRANSPOSITIONS:
+        image = image.transpose(TRANSPOSITIONS[orientation])
+    if image.mode not in ('RGB', 'RGBA', 'L'):
+        has_alpha = (
+            image.mode in ('LA', 'PA') or 'transparency' in image.info
+        )
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+    return image
+
+
+def resize(image, target):
+    """Масштабирует изображение под миниатюру. С crop заполняет
+    её целиком и обрезает по центру, иначе вписывает. Большие
+    уменьшения сначала выполняются быстрым Image.reduce.
+    """
+    scale = _scale(image.size, target)
+    size = (
+        max(1, round(image.width * scale)),
+        max(1, round(image.height * scale)),
+    )
+    if size != image.size:
+        image = image.resize(size, Image.LANCZOS, reducing_gap=3.0)
+    if target.crop:
+        width = min(target.width, image.width)
+        height = min(target.height, image.height)
+        left = (image.width - width) // 2
+        top = (image.height - height) // 2
+        image = image.crop((left, top, left + width, top + height))
+    return image
+
+
+def encode(image, target):
+    """Кодирует миниатюру без метаданных исходника (EXIF, ICC, XMP)."""
+    if target.format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    image.info = {}
+    options = {'quality': target.quality}
+    if target.format == 'JPEG':
+        options.update(optimize=True, progressive=target.progressive)
+    buffer = io.BytesIO()
+    image.save(buffer, target.format, **options)
+    return buffer.getvalue()
+
+
+def process_image(source, targets, max_pixels):
+    """Проверяет изображение и строит все миниатюры за одно
+    декодирование. Отдаёт список пар (байты, (ширина, высота))
+    в порядке targets.
+
+    Не зависит от Django, поэтому выполняется в процессах пула:
+    они получают путь к исходнику или его байты и ничего не пишут.
+    """
+    with open_image(source, max_pixels) as image:
+        # EXIF читается до декодирования: после load() Pillow
+        # закрывает файл TIFF и уже не может его прочитать.
+        orientation = image.getexif().get(ORIENTATION_TAG)
+        _draft(image, targets, orientation)
+        try:
+            image.load()
+        except (OSError, SyntaxError) as error:
+            raise ImageRejected(str(error)) from error
+        image = _normalize(image, orientation)
+        results = []
+        for target in targets:
+            thumbnail = resize(image, target)
+            results.append((encode(thumbnail, target), thumbnail.size))
+        return results
@@ -0,0 +1,55 @@
+from sorl.thumbnail.conf import settings
+from sorl.thumbnail.images import deserialize_image_file
+from sorl.thumbnail.kvstores import cached_db_kvstore
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+
+class KVStore(cached_db_kvstore.KVStore):
+    """Хранилище ключей sorl (кэш + база данных), которое умеет
+    читать записи о многих миниатюрах одним запросом.
+    """
+
+    def get_many(self, image_files):
+        """Отдаёт найденные в хранилище файлы словарём {key: ImageFile}."""
+        keys = {add_prefix(image_file.key): image_file.key
+                for image_file in image_files}
+        values = self._get_many_raw(list(keys))
+        return {
+            keys[raw_key]: deserialize_image_file(value)
+            for raw_key, value in values.items()
+        }
+
+    def _get_many_raw(self, keys):
+        values = self.cache.get_many(keys)
+        missing = [key for key in keys if key not in values]
+        if missing:
+            found = dict(
+                KVStoreModel.objects.filter(
+                    key__in=missing,
+                ).values_list('key', 'value')
+            )
+            # отсутствующие ключи тоже кэшируются, как в _get_raw
+            fetched = {
+                key: found.get(key, cached_db_kvstore.EMPTY_VALUE)
+                for key in missing
+            }
+            self.cache.set_many(fetched, settings.THUMBNAIL_CACHE_TIMEOUT)
+            values.update(fetched)
+        return {
+            key: value for key, value in values.items()
+            if value != cached_db_kvstore.EMPTY_VALUE
+        }
+
+    def delete_many(self, image_files):
+        """Удаляет записи о файлах и списки их миниатюр (сами файлы
+        не трогает) одним запросом к базе данных.
+        """
+        keys = [
+            add_prefix(image_file.key, identity)
+            for image_file in image_files
+            for identity in ('image', 'thumbnails')
+        ]
+        if keys:
+            KVStoreModel.objects.filter(key__in=keys).delete()
+            self.cache.delete_many(keys)
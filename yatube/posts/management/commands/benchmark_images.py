@@ -0,0 +1,158 @@
+import multiprocessing
+import os
+import resource
+import statistics
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image, ImageOps
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.parsers import parse_geometry
+
+from posts.image_pipeline import Target, init_worker, process_image
+from posts.thumbnails import THUMBNAIL_GEOMETRIES
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+
+
+def naive_process(path, targets):
+    """Обработка без draft и reduce: полное декодирование
+    и масштабирование исходника под каждую миниатюру.
+    """
+    with Image.open(path) as image:
+        image = image.convert('RGB')
+        for target in targets:
+            thumbnail = ImageOps.fit(
+                image, (target.width, target.height), Image.LANCZOS,
+            )
+            thumbnail.save(os.devnull, 'JPEG', quality=target.quality)
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает время и память обработки изображений: Pillow '
+        'без оптимизаций, конвейер в текущем процессе и в пуле процессов.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--corpus',
+            help='Каталог с изображениями; по умолчанию создаются '
+                 'синтетические JPEG.',
+        )
+        parser.add_argument('--count', type=int, default=20)
+        parser.add_argument('--size', default='4000x3000')
+        parser.add_argument(
+            '--workers', type=int, default=settings.POSTS_IMAGE_WORKERS,
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        targets = [
+            Target(
+                *parse_geometry(geometry), bool(params.get('crop')),
+                params.get('upscale', False), 'JPEG',
+                sorl_settings.THUMBNAIL_QUALITY,
+                sorl_settings.THUMBNAIL_PROGRESSIVE,
+            )
+            for geometry, params in THUMBNAIL_GEOMETRIES.values()
+        ]
+        if options['corpus']:
+            self.run(self.corpus(options['corpus']), targets)
+            return
+        with tempfile.TemporaryDirectory() as directory:
+            self.run(self.generate(directory), targets)
+
+    def corpus(self, directory):
+        paths = sorted(
+            os.path.join(directory, name) for name in os.listdir(directory)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        if not paths:
+            raise CommandError(f'В каталоге {directory} нет изображений.')
+        return paths
+
+    def generate(self, directory):
+        width, height = parse_geometry(self.options['size'])
+        paths = []
+        for i in range(self.options['count']):
+            image = Image.linear_gradient('L').resize((width, height))
+            image = Image.merge('RGB', (
+                image, image.rotate(90 * (i % 4)), image.transpose(
+                    Image.FLIP_LEFT_RIGHT,
+                ),
+            ))
+            path = os.path.join(directory, f'sample_{i}.jpg')
+            image.save(path, 'JPEG', quality=90)
+            paths.append(path)
+        return paths
+
+    def report(self, title, timings, started, peak):
+        """Пик памяти — максимальный RSS процесса (или процессов пула)
+        за всё время, поэтому замеры идут от экономного к затратному.
+        """
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.MIGRATE_HEADING(title))
+        if timings:
+            self.stdout.write(
+                f'  медиана {statistics.median(timings) * 1000:.1f} мс, '
+                f'максимум {max(timings) * 1000:.1f} мс на изображение'
+            )
+        self.stdout.write(
+            f'  {len(self.paths) / elapsed:.2f} изображений/с, '
+            f'всего {elapsed:.2f} с, пик памяти {peak // 1024} МиБ'
+        )
+
+    def measure(self, process):
+        timings = []
+        for path in self.paths:
+            started = time.perf_counter()
+            process(path)
+            timings.append(time.perf_counter() - started)
+        return timings
+
+    def run(self, paths, targets):
+        self.paths = paths
+        max_pixels = settings.POSTS_IMAGE_MAX_PIXELS
+        self.stdout.write(f'Изображений: {len(paths)}')
+
+        started = time.perf_counter()
+        timings = self.measure(
+            lambda path: process_image(path, targets, max_pixels)
+        )
+        self.report(
+            'Конвейер в текущем процессе', timings, started,
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        )
+
+        started = time.perf_counter()
+        timings = self.measure(lambda path: naive_process(path, targets))
+        self.report(
+            'Pillow без draft/reduce', timings, started,
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        )
+
+        workers = self.options['workers']
+        if workers < 1:
+            return
+        started = time.perf_counter()
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_worker,
+            initargs=(settings.POSTS_IMAGE_MEMORY_LIMIT, max_pixels),
+        ) as pool:
+            futures = [
+                pool.submit(process_image, path, targets, max_pixels)
+                for path in paths
+            ]
+            for future in futures:
+                future.result()
+        self.report(
+            f'Конвейер в пуле из {workers} процессов (с их запуском)',
+            [], started,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        )
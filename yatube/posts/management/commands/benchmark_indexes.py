@@ -0,0 +1,142 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from posts.models import Comment, Follow, Group, Post, User
+
+
+class Rollback(Exception):
+    """Откатывает транзакцию с тестовыми данными."""
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет базу тестовыми данными и сравнивает планы и время '
+        'запросов лент с составными индексами и без них. '
+        'Все изменения откатываются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=50)
+        parser.add_argument('--posts', type=int, default=200000)
+        parser.add_argument('--comments', type=int, default=200000)
+        parser.add_argument('--follows', type=int, default=20000)
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Сколько раз выполнять каждый запрос.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help='Размер пачки вставки; по умолчанию — максимум для СУБД.',
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        try:
+            with connection.constraint_checks_disabled():
+                with transaction.atomic():
+                    self.seed()
+                    self.report('С индексами')
+                    self.drop_indexes()
+                    self.report('Без индексов')
+                    raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self):
+        options = self.options
+        batch_size = options['batch_size']
+        self.stdout.write('Заполняем базу...')
+        User.objects.bulk_create(
+            User(username=f'bench_user_{i}')
+            for i in range(options['users'])
+        )
+        users = list(
+            User.objects.filter(username__startswith='bench_user_')
+        )
+        Group.objects.bulk_create(
+            Group(
+                title=f'Группа {i}', slug=f'bench-group-{i}',
+                description='Группа для замеров',
+            )
+            for i in range(options['groups'])
+        )
+        groups = list(Group.objects.filter(slug__startswith='bench-group-'))
+        Post.objects.bulk_create(
+            (
+                Post(
+                    text=f'Пост {i}',
+                    author=users[i % len(users)],
+                    group=groups[i % len(groups)] if i % 3 else None,
+                )
+                for i in range(options['posts'])
+            ),
+            batch_size=batch_size,
+        )
+        self.post = Post.objects.order_by('pk').first()
+        post_ids = list(
+            Post.objects.values_list('pk', flat=True)[:options['posts'] // 10]
+        )
+        Comment.objects.bulk_create(
+            (
+                Comment(
+                    text=f'Комментарий {i}',
+                    post_id=post_ids[i % len(post_ids)],
+                    author=users[i % len(users)],
+                )
+                for i in range(options['comments'])
+            ),
+            batch_size=batch_size,
+        )
+        Follow.objects.bulk_create(
+            (
+                Follow(
+                    user=users[i % len(users)],
+                    author=users[(i // len(users) + 1 + i) % len(users)],
+                )
+                for i in range(options['follows'])
+            ),
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+        self.author = users[0]
+        self.reader = users[-1]
+        self.group = groups[0]
+        if connection.vendor in ('sqlite', 'postgresql'):
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+    def queries(self):
+        return {
+            'Посты автора': Post.objects.filter(author=self.author)[:10],
+            'Посты группы': Post.objects.filter(group=self.group)[:10],
+            'Комментарии поста': Comment.objects.filter(post=self.post)[:10],
+            'Проверка подписки': Follow.objects.filter(
+                user=self.reader, author=self.author,
+            )[:1],
+        }
+
+    def report(self, title):
+        self.stdout.write(self.style.MIGRATE_HEADING(title))
+        for name, queryset in self.queries().items():
+            timings = []
+            for _ in range(self.options['repeat']):
+                started = time.perf_counter()
+                list(queryset.all())
+                timings.append(time.perf_counter() - started)
+            self.stdout.write(
+                f'{name}: медиана {statistics.median(timings) * 1000:.3f} мс'
+            )
+            self.stdout.write(queryset.explain())
+
+    def drop_indexes(self):
+        """Удаляет составные индексы. Уникальность подписок
+        не снимается: она защищает данные, а не только ускоряет поиск.
+        """
+        with connection.schema_editor() as schema_editor:
+            for model in (Post, Comment):
+                for index in model._meta.indexes:
+                    schema_editor.remove_index(model, index)
@@ -0,0 +1,447 @@
+import json
+import math
+import os
+import platform
+import random
+import re
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from http.client import HTTPConnection
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+import django
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.core.servers.basehttp import (ThreadedWSGIServer,
+                                          WSGIRequestHandler)
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from posts.constants import POSTS_PER_PAGE
+from posts.feed import backfill_many
+from posts.models import Comment, Follow, Group, Post, User
+
+VIEWS = (
+    'index', 'group_posts', 'profile', 'post_detail', 'follow_index',
+    'add_comment',
+)
+TRANSPORTS = ('client', 'wsgi')
+PERCENTILES = (50, 90, 95, 99)
+# Префикс имён пользователей и адресов групп набора (см. seed);
+# отличается от данных benchmark_indexes, которые тот откатывает.
+PREFIX = 'bench-views-'
+CSRF_INPUT = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+
+def percentile(ordered, percent):
+    """Процентиль по методу ближайшего ранга."""
+    rank = math.ceil(percent / 100 * len(ordered))
+    return ordered[max(rank, 1) - 1]
+
+
+def summarize(timings, errors, elapsed):
+    """Сводка замеров одной страницы: задержки в миллисекундах
+    и пропускная способность в запросах в секунду.
+    """
+    ordered = sorted(timings)
+    summary = {
+        'requests': len(ordered),
+        'errors': errors,
+        'throughput': round(len(ordered) / elapsed, 2) if elapsed else None,
+    }
+    if ordered:
+        summary.update({
+            f'p{percent}': round(percentile(ordered, percent) * 1000, 3)
+            for percent in PERCENTILES
+        })
+        summary['mean'] = round(sum(ordered) / len(ordered) * 1000, 3)
+        summary['max'] = round(ordered[-1] * 1000, 3)
+    return summary
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ('git', 'rev-parse', 'HEAD'), cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        f'Заполняет базу командой seed (пользователи {PREFIX}*) '
+        'и замеряет задержки (процентили) и пропускную способность '
+        'страниц через тестовый клиент Django и локальный WSGI-сервер. '
+        'Результаты сохраняются в JSON для сравнения между коммитами. '
+        'Данные остаются в текущей базе и переиспользуются при '
+        'следующих запусках.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument('--groups', type=int, default=1000)
+        parser.add_argument('--posts', type=int, default=1000000)
+        parser.add_argument('--comments', type=int, default=1000000)
+        parser.add_argument(
+            '--follows-per-user', type=int, default=20,
+            help='Сколько авторов читает каждый пользователь.',
+        )
+        parser.add_argument(
+            '--readers', type=int, default=20,
+            help='Сколько пользователей выполняют запросы от своего '
+                 'имени; их ленты подписок заполняются.',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--processes', type=int, default=os.cpu_count(),
+            help='Процессы, генерирующие данные (см. seed).',
+        )
+        parser.add_argument(
+            '--reseed', action='store_true',
+            help='Удалить данные прошлых запусков и заполнить заново.',
+        )
+        parser.add_argument(
+            '--random-seed', type=int, default=1,
+            help='Зерно генератора данных и запросов.',
+        )
+        parser.add_argument(
+            '--views', nargs='+', choices=VIEWS, default=list(VIEWS),
+        )
+        parser.add_argument(
+            '--transports', nargs='+', choices=TRANSPORTS,
+            default=list(TRANSPORTS),
+        )
+        parser.add_argument(
+            '--requests', type=int, default=200,
+            help='Замеряемых запросов к каждой странице.',
+        )
+        parser.add_argument(
+            '--warmup', type=int, default=20,
+            help='Запросов к каждой странице до начала замеров.',
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=4,
+            help='Параллельных клиентов WSGI-сервера.',
+        )
+        parser.add_argument(
+            '--output',
+            help='Файл отчёта; по умолчанию benchmark_views_<коммит>.json.',
+        )
+        parser.add_argument(
+            '--compare',
+            help='Отчёт прошлого запуска, с которым сравнить результаты.',
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.rng = random.Random(options['random_seed'])
+        if options['reseed']:
+            self.flush()
+        if not User.objects.filter(username=f'{PREFIX}0').exists():
+            started = time.perf_counter()
+            self.seed()
+            self.stdout.write(
+                f'Данные созданы за {time.perf_counter() - started:.1f} с'
+            )
+        self.load_dataset()
+
+        results = []
+        for transport in options['transports']:
+            run = getattr(self, f'run_{transport}')
+            for view in options['views']:
+                summary = run(view)
+                summary.update(view=view, transport=transport)
+                results.append(summary)
+                self.print_summary(summary)
+
+        commit = git_commit()
+        report = {
+            'meta': {
+                'commit': commit,
+                'created': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'debug': settings.DEBUG,
+                'dataset': self.dataset,
+                'options': {
+                    key: options[key] for key in (
+                        'requests', 'warmup', 'concurrency', 'random_seed',
+                    )
+                },
+            },
+            'results': results,
+        }
+        output = options['output'] or (
+            f'benchmark_views_{(commit or "local")[:12]}.json'
+        )
+        with open(output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        self.stdout.write(f'Отчёт сохранён в {output}')
+        if options['compare']:
+            self.compare(results, options['compare'])
+
+    def flush(self):
+        self.stdout.write('Удаляем данные прошлых запусков...')
+        Group.objects.filter(slug__startswith=PREFIX).delete()
+        User.objects.filter(username__startswith=PREFIX).delete()
+
+    def seed(self):
+        """Заполняет базу командой seed; ленты подписок заполняются
+        только для читателей, от имени которых идут запросы.
+        """
+        options = self.options
+        call_command(
+            'seed', users=options['users'], groups=options['groups'],
+            posts=options['posts'], comments=options['comments'],
+            follows=options['users'] * options['follows_per_user'],
+            processes=options['processes'],
+            batch_size=options['batch_size'], seed=options['random_seed'],
+            prefix=PREFIX, no_feeds=True, stdout=self.stdout,
+        )
+        readers = list(
+            User.objects.filter(username__startswith=PREFIX)
+            .order_by('pk').values_list('pk', flat=True)[:options['readers']]
+        )
+        backfill_many(
+            Follow.objects.filter(user_id__in=readers)
+            .values_list('user_id', 'author_id')
+        )
+
+    def post_range(self):
+        """Первый и последний id постов набора: посты вставлены
+        подряд, поэтому случайный пост — случайный id из диапазона.
+        """
+        posts = Post.objects.filter(
+            author__username__startswith=PREFIX,
+        ).order_by('pk').values_list('pk', flat=True)
+        return posts.first(), posts.last()
+
+    def load_dataset(self):
+        users = User.objects.filter(username__startswith=PREFIX)
+        self.usernames = list(
+            users.order_by('pk').values_list('username', flat=True)
+        )
+        self.readers = list(users.order_by('pk')[:self.options['readers']])
+        self.slugs = list(
+            Group.objects.filter(slug__startswith=PREFIX)
+            .values_list('slug', flat=True)
+        )
+        self.first_post, self.last_post = self.post_range()
+        posts = Post.objects.filter(author__in=users)
+        self.dataset = {
+            'users': len(self.usernames),
+            'groups': len(self.slugs),
+            'posts': posts.count(),
+            'comments': Comment.objects.filter(post__in=posts).count(),
+            'follows': Follow.objects.filter(user__in=users).count(),
+        }
+        self.stdout.write(
+            'Набор данных: ' + ', '.join(
+                f'{name} {count}' for name, count in self.dataset.items()
+            )
+        )
+
+    def pages(self, count):
+        return self.rng.randint(1, max(1, min(count, 5 * POSTS_PER_PAGE)))
+
+    def make_request(self, view):
+        """Случайный запрос к странице view: (читатель или None, метод,
+        путь, данные формы).
+        """
+        rng = self.rng
+        if view == 'index':
+            return None, 'GET', reverse('posts:index'), {
+                'page': self.pages(10),
+            }
+        if view == 'group_posts':
+            return None, 'GET', reverse(
+                'posts:group_list', args=(rng.choice(self.slugs),),
+            ), {'page': self.pages(3)}
+        if view == 'profile':
+            return None, 'GET', reverse(
+                'posts:profile', args=(rng.choice(self.usernames),),
+            ), {'page': self.pages(2)}
+        post_id = rng.randint(self.first_post, self.last_post)
+        if view == 'post_detail':
+            return None, 'GET', reverse(
+                'posts:post_detail', args=(post_id,),
+            ), {}
+        reader = rng.choice(self.readers)
+        if view == 'follow_index':
+            return reader, 'GET', reverse('posts:follow_index'), {
+                'page': self.pages(3),
+            }
+        return reader, 'POST', reverse(
+            'posts:add_comment', args=(post_id,),
+        ), {'text': 'Комментарий из замера'}
+
+    def measure(self, view, send, concurrency=1):
+        """Выполняет разогрев и замер запросов к view через send.
+        Запросы готовятся заранее, чтобы генератор не попадал в замер.
+        """
+        options = self.options
+        warmup = [self.make_request(view) for _ in range(options['warmup'])]
+        requests = [
+            self.make_request(view) for _ in range(options['requests'])
+        ]
+        for request in warmup:
+            send(*request)
+        timings = []
+        errors = 0
+        lock = threading.Lock()
+
+        def timed(request):
+            nonlocal errors
+            started = time.perf_counter()
+            status = send(*request)
+            elapsed = time.perf_counter() - started
+            with lock:
+                timings.append(elapsed)
+                if status >= 400:
+                    errors += 1
+
+        started = time.perf_counter()
+        if concurrency > 1:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                list(pool.map(timed, requests))
+        else:
+            for request in requests:
+                timed(request)
+        return summarize(timings, errors, time.perf_counter() - started)
+
+    def run_client(self, view):
+        anonymous = Client(SERVER_NAME='localhost')
+        clients = {}
+        for reader in self.readers:
+            clients[reader.pk] = Client(SERVER_NAME='localhost')
+            clients[reader.pk].force_login(reader)
+
+        def send(reader, method, path, data):
+            client = anonymous if reader is None else clients[reader.pk]
+            return getattr(client, method.lower())(path, data).status_code
+
+        return self.measure(view, send)
+
+    def run_wsgi(self, view):
+        server = ThreadedWSGIServer(
+            ('127.0.0.1', 0), QuietRequestHandler, allow_reuse_address=False,
+        )
+        server.set_app(get_wsgi_application())
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        host, port = server.server_address
+        try:
+            sessions = {
+                reader.pk: self.wsgi_session(host, port, reader)
+                for reader in self.readers
+            }
+
+            def send(reader, method, path, data):
+                headers = {}
+                if reader is not None:
+                    cookies, token = sessions[reader.pk]
+                    headers['Cookie'] = cookies
+                    if method == 'POST':
+                        data = {**data, 'csrfmiddlewaretoken': token}
+                body = urlencode(data)
+                if method == 'GET':
+                    path, body = f'{path}?{body}' if body else path, None
+                else:
+                    headers['Content-Type'] = (
+                        'application/x-www-form-urlencoded'
+                    )
+                return self.http_request(
+                    host, port, method, path, body, headers,
+                ).status
+
+            return self.measure(
+                view, send, concurrency=self.options['concurrency'],
+            )
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def http_request(self, host, port, method, path, body=None,
+                     headers=None):
+        http = HTTPConnection(host, port, timeout=60)
+        try:
+            http.request(method, path, body, headers or {})
+            response = http.getresponse()
+            response.body = response.read()
+            return response
+        finally:
+            http.close()
+
+    def wsgi_session(self, host, port, reader):
+        """Cookie сессии читателя и CSRF-токен для его POST-запросов:
+        сессия создаётся тестовым клиентом, токен берётся из формы
+        комментария.
+        """
+        client = Client()
+        client.force_login(reader)
+        cookie = client.cookies[settings.SESSION_COOKIE_NAME]
+        cookies = f'{cookie.key}={cookie.value}'
+        response = self.http_request(
+            host, port, 'GET',
+            reverse('posts:post_detail', args=(self.first_post,)),
+            headers={'Cookie': cookies},
+        )
+        received = SimpleCookie()
+        for header in response.msg.get_all('Set-Cookie') or ():
+            received.load(header)
+        match = CSRF_INPUT.search(response.body.decode())
+        if settings.CSRF_COOKIE_NAME in received and match:
+            csrf = received[settings.CSRF_COOKIE_NAME].value
+            cookies += f'; {settings.CSRF_COOKIE_NAME}={csrf}'
+            return cookies, match.group(1)
+        return cookies, ''
+
+    def print_summary(self, summary):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'{summary["transport"]} {summary["view"]}'
+        ))
+        if not summary['requests']:
+            return
+        self.stdout.write(
+            '  ' + ', '.join(
+                f'p{percent} {summary[f"p{percent}"]:.1f} мс'
+                for percent in PERCENTILES
+            )
+            + f', {summary["throughput"]:.1f} запросов/с'
+            + f', ошибок {summary["errors"]}'
+        )
+
+    def compare(self, results, path):
+        with open(path, encoding='utf-8') as file:
+            previous = {
+                (result['transport'], result['view']): result
+                for result in json.load(file)['results']
+            }
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Сравнение с {path}'))
+        for result in results:
+            before = previous.get((result['transport'], result['view']))
+            if not before or not result['requests']:
+                continue
+            changes = ', '.join(
+                f'{key} {(result[key] / before[key] - 1) * 100:+.1f}%'
+                for key in ('p50', 'p95', 'throughput')
+                if before.get(key)
+            )
+            self.stdout.write(
+                f'  {result["transport"]} {result["view"]}: {changes}'
+            )
@@ -0,0 +1,230 @@
+import os
+import sqlite3
+import tempfile
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.template.defaultfilters import filesizeformat
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from posts.models import Post
+from posts.thumbnails import delete_image, thumbnail_files
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def walk(storage, directory):
+    """Обходит каталог хранилища, не загружая список файлов целиком.
+    Отдаёт пары (имя в хранилище, os.DirEntry).
+    """
+    try:
+        root = storage.path('')
+    except NotImplementedError:
+        raise CommandError('Поддерживаются только локальные хранилища.')
+    stack = [os.path.join(root, directory)]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    name = os.path.relpath(entry.path, root)
+                    yield name.replace(os.sep, '/'), entry
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет изображения, на которые не ссылается ни один пост, '
+        'миниатюры без исходников и устаревшие записи хранилища '
+        'ключей sorl-thumbnail. Файлы и записи обходятся пачками, '
+        'поэтому память не растёт с размером MEDIA_ROOT.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--min-age', type=int, default=settings.POSTS_IMAGE_REUSE_GRACE,
+            help='Не трогать файлы моложе стольких секунд: они могут '
+                 'принадлежать ещё не сохранённым постам.',
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, что будет удалено.',
+        )
+        parser.add_argument(
+            '--interval', type=int,
+            help='Повторять сборку каждые столько секунд.',
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        while True:
+            self.collect()
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
+
+    def collect(self):
+        self.deadline = time.time() - self.options['min_age']
+        self.report('Исходные изображения', *self.collect_sources())
+        self.report('Миниатюры', *self.collect_thumbnails())
+        self.report('Записи хранилища ключей', *self.collect_kvstore())
+        if self.options['dry_run']:
+            self.stdout.write('Пробный запуск: ничего не удалено.')
+
+    def report(self, title, scanned, orphans, size=None):
+        line = f'{title}: просмотрено {scanned}, к удалению {orphans}'
+        if size is not None:
+            line += f' ({filesizeformat(size)})'
+        self.stdout.write(line)
+
+    def old_files(self, storage, directory):
+        for name, entry in walk(storage, directory):
+            stat = entry.stat(follow_symlinks=False)
+            if stat.st_mtime < self.deadline:
+                yield name, stat.st_size
+
+    def collect_orphans(self, files, find_live, delete):
+        """Проходит файлы пачками: find_live отдаёт живые имена пачки,
+        остальные передаются в delete. Отдаёт число просмотренных
+        файлов, число осиротевших и их объём.
+        """
+        scanned = orphans = size = 0
+        for batch in batches(files, self.options['batch_size']):
+            scanned += len(batch)
+            live = find_live([name for name, _ in batch])
+            batch = [(name, bytes_) for name, bytes_ in batch
+                     if name not in live]
+            orphans += len(batch)
+            size += sum(bytes_ for _, bytes_ in batch)
+            if self.options['verbosity'] > 1:
+                for name, _ in batch:
+                    self.stdout.write(f'  {name}')
+            if batch and not self.options['dry_run']:
+                delete([name for name, _ in batch])
+        return scanned, orphans, size
+
+    def collect_sources(self):
+        field = Post._meta.get_field('image')
+        storage = field.storage
+
+        def find_live(names):
+            return set(
+                Post.objects.filter(image__in=names)
+                .values_list('image', flat=True)
+            )
+
+        def delete(names):
+            for name in names:
+                delete_image(
+                    ImageFile(name, storage), self.options['min_age'],
+                )
+
+        return self.collect_orphans(
+            self.old_files(storage, field.upload_to), find_live, delete,
+        )
+
+    def collect_thumbnails(self):
+        """Имена миниатюр живых постов складываются во временную
+        базу SQLite на диске, с ней сверяются файлы каталога миниатюр.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            live = sqlite3.connect(os.path.join(directory, 'live.db'))
+            try:
+                self.fill_live_thumbnails(live)
+
+                def find_live(names):
+                    placeholders = ', '.join('?' * len(names))
+                    return {
+                        name for name, in live.execute(
+                            'SELECT name FROM live '
+                            f'WHERE name IN ({placeholders})',
+                            names,
+                        )
+                    }
+
+                def delete(names):
+                    thumbnails = [
+                        ImageFile(name, default.storage) for name in names
+                    ]
+                    default.kvstore.delete_many(thumbnails)
+                    for thumbnail in thumbnails:
+                        thumbnail.delete()
+
+                return self.collect_orphans(
+                    self.old_files(
+                        default.storage, sorl_settings.THUMBNAIL_PREFIX,
+                    ),
+                    find_live,
+                    delete,
+                )
+            finally:
+                live.close()
+
+    def fill_live_thumbnails(self, live):
+        live.execute('CREATE TABLE live (name TEXT PRIMARY KEY)')
+        storage = Post._meta.get_field('image').storage
+        images = (
+            Post.objects.exclude(image='')
+            .values_list('image', flat=True)
+            .distinct()
+            .iterator(chunk_size=self.options['batch_size'])
+        )
+        for batch in batches(images, self.options['batch_size']):
+            live.executemany(
+                'INSERT OR IGNORE INTO live VALUES (?)',
+                (
+                    (thumbnail.name,)
+                    for name in batch
+                    for thumbnail in thumbnail_files(ImageFile(name, storage))
+                ),
+            )
+        live.commit()
+
+    def collect_kvstore(self):
+        """Записи о файлах, которых больше нет. Записи читаются
+        пачками по возрастанию ключа, поэтому их можно удалять
+        по ходу обхода.
+        """
+        prefix = add_prefix('', 'image')
+        scanned = stale = 0
+        last_key = ''
+        while True:
+            batch = list(
+                KVStoreModel.objects.filter(
+                    key__startswith=prefix, key__gt=last_key,
+                ).order_by('key').values_list('key', 'value')[
+                    :self.options['batch_size']
+                ]
+            )
+            if not batch:
+                break
+            last_key = batch[-1][0]
+            scanned += len(batch)
+            missing = [
+                image_file for image_file in (
+                    deserialize_image_file(value) for _, value in batch
+                )
+                if not image_file.exists()
+            ]
+            stale += len(missing)
+            if missing and not self.options['dry_run']:
+                default.kvstore.delete_many(missing)
+        return scanned, stale
@@ -0,0 +1,49 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts.transfer import FIELDS, FORMATS, export_rows, file_name, write_rows
+
+
+class Command(BaseCommand):
+    help = (
+        'Выгружает группы, посты, комментарии и подписки в каталог: '
+        'по файлу JSON Lines или CSV на модель. Записи читаются из БД '
+        'потоком, без загрузки таблицы в память. Файлы изображений '
+        'не копируются — выгружаются только их имена.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Каталог для файлов.')
+        parser.add_argument(
+            '--format', choices=FORMATS, default='jsonl',
+            help='Формат файлов.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=2000,
+            help='Количество записей, читаемых из БД за раз.',
+        )
+        parser.add_argument(
+            '--models', nargs='+', choices=list(FIELDS),
+            default=list(FIELDS), help='Что выгружать.',
+        )
+
+    def handle(self, *args, **options):
+        directory, fmt = options['directory'], options['format']
+        os.makedirs(directory, exist_ok=True)
+        for name in FIELDS:
+            if name not in options['models']:
+                continue
+            started = time.perf_counter()
+            path = os.path.join(directory, file_name(name, fmt))
+            with open(path, 'w', encoding='utf-8', newline='') as file:
+                total = write_rows(
+                    file, fmt, FIELDS[name],
+                    export_rows(name, options['batch_size']),
+                )
+            elapsed = time.perf_counter() - started
+            self.stdout.write(self.style.SUCCESS(
+                f'{name}: выгружено {total} за {elapsed:.1f} с '
+                f'({total / elapsed:.0f} записей/с) в {path}'
+            ))
@@ -0,0 +1,76 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+
+from posts.transfer import FIELDS, FORMATS, Importer, file_name, read_rows
+
+# Сколько ошибок проверки выводить.
+SHOWN_ERRORS = 20
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает группы, посты, комментарии и подписки из каталога, '
+        'созданного export_content: пачками через bulk_create, с проверкой '
+        'текстов clean_text. Посты и комментарии сохраняют id, если они '
+        'указаны. Вся загрузка идёт в одной транзакции.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Каталог с файлами.')
+        parser.add_argument(
+            '--format', choices=FORMATS, default='jsonl',
+            help='Формат файлов.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Количество записей, вставляемых за раз.',
+        )
+        parser.add_argument(
+            '--models', nargs='+', choices=list(FIELDS),
+            default=list(FIELDS), help='Что загружать.',
+        )
+        parser.add_argument(
+            '--skip-invalid', action='store_true',
+            help='Пропускать строки с ошибками вместо отмены загрузки.',
+        )
+
+    def handle(self, *args, **options):
+        directory, fmt = options['directory'], options['format']
+        importer = Importer(options['batch_size'])
+        try:
+            with transaction.atomic():
+                for name in FIELDS:
+                    path = os.path.join(directory, file_name(name, fmt))
+                    if name in options['models'] and os.path.exists(path):
+                        self.load(importer, name, path, fmt)
+                self.report_errors(importer.errors, options['skip_invalid'])
+                importer.finish()
+        except IntegrityError as error:
+            raise CommandError(
+                f'Записи конфликтуют с уже существующими: {error}'
+            )
+
+    def load(self, importer, name, path, fmt):
+        started = time.perf_counter()
+        with open(path, encoding='utf-8', newline='') as file:
+            total = importer.load(name, read_rows(file, fmt))
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'{name}: загружено {total} за {elapsed:.1f} с '
+            f'({total / elapsed:.0f} записей/с)'
+        ))
+
+    def report_errors(self, errors, skip_invalid):
+        if not errors:
+            return
+        shown = '\n'.join(errors[:SHOWN_ERRORS])
+        if not skip_invalid:
+            raise CommandError(
+                f'Ошибок в данных: {len(errors)}, загрузка отменена.\n{shown}'
+            )
+        self.stderr.write(
+            f'Пропущено строк с ошибками: {len(errors)}\n{shown}'
+        )
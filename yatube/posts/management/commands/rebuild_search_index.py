@@ -0,0 +1,60 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.models import Comment, Post
+from posts.search import get_backend
+
+
+class Command(BaseCommand):
+    help = (
+        'Перестраивает индекс полнотекстового поиска по постам '
+        'и комментариям. Индекс заменяется в одной транзакции, поэтому '
+        'поиск не видит его наполовину заполненным.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Количество записей, индексируемых за раз.',
+        )
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        backend = get_backend()
+        started = time.perf_counter()
+        with transaction.atomic():
+            backend.setup()
+            backend.clear()
+            posts = self.index(
+                Post.objects.only('pk', 'text'), backend.index_posts,
+            )
+            comments = 0
+            if settings.POSTS_SEARCH_COMMENTS:
+                comments = self.index(
+                    Comment.objects.only('pk', 'text', 'post_id'),
+                    backend.index_comments,
+                )
+        backend.optimize()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Проиндексировано постов: {posts}, комментариев: {comments} '
+            f'за {elapsed:.1f} с '
+            f'({(posts + comments) / elapsed:.0f} записей/с)'
+        ))
+
+    def index(self, queryset, index):
+        total = 0
+        batch = []
+        for obj in queryset.order_by().iterator(chunk_size=self.batch_size):
+            batch.append(obj)
+            if len(batch) == self.batch_size:
+                index(batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            index(batch)
+            total += len(batch)
+        return total
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import User, UserStats
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики постов и подписок пользователей.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'usernames', nargs='*',
+            help='Имена пользователей; по умолчанию — все.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Количество пользователей, пересчитываемых за раз.',
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('pk')
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+        batch_size = options['batch_size']
+        user_ids = users.values_list('pk', flat=True).iterator(
+            chunk_size=batch_size
+        )
+        total = 0
+        batch = []
+        for user_id in user_ids:
+            batch.append(user_id)
+            if len(batch) == batch_size:
+                total += len(UserStats.objects.rebuild(batch))
+                batch = []
+        if batch:
+            total += len(UserStats.objects.rebuild(batch))
+        self.stdout.write(
+            self.style.SUCCESS(f'Пересчитано пользователей: {total}')
+        )
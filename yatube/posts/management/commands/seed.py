@@ -0,0 +1,335 @@
+import os
+import random
+import time
+from bisect import bisect
+from datetime import timedelta
+from itertools import accumulate
+from multiprocessing import Pool
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Max
+from django.utils import timezone
+from faker import Faker
+
+from posts.cache import ALL_LISTINGS, bump_listings, invalidate_counts
+from posts.feed import backfill_many
+from posts.models import Comment, Follow, Group, Post, User
+from posts.transfer import reset_sequences
+
+# Состояние генератора в процессе-работнике (см. init_worker).
+STATE = {}
+
+
+def zipf_weights(size, alpha):
+    """Накопленные веса закона Ципфа: вес ранга r — 1 / r ** alpha."""
+    return list(accumulate(1 / rank ** alpha for rank in range(1, size + 1)))
+
+
+def pick(rng, population, cum_weights):
+    """Случайный элемент population с накопленными весами."""
+    return population[
+        bisect(cum_weights, rng.random() * cum_weights[-1])
+    ]
+
+
+def init_worker(state):
+    STATE.clear()
+    STATE.update(state)
+    STATE['faker'] = Faker(state['locale'])
+
+
+def task_random(kind, start):
+    """Генераторы пачек детерминированы: зерно зависит только от
+    --seed и места пачки, а не от процесса, который её строит.
+    """
+    seed = f'{STATE["seed"]}:{kind}:{start}'
+    STATE['faker'].seed_instance(seed)
+    return random.Random(seed), STATE['faker']
+
+
+def post_date(index):
+    """Посты идут по времени: чем больше номер, тем новее."""
+    return STATE['started'] + STATE['span'] * index / STATE['posts']
+
+
+def generate(task):
+    """Строит пачку строк kind с номерами start…start + size."""
+    kind, start, size = task
+    rng, faker = task_random(kind, start)
+    if kind == 'users':
+        return [
+            (
+                f'{STATE["prefix"]}{start + i}', faker.first_name(),
+                faker.last_name(), faker.free_email(),
+            )
+            for i in range(size)
+        ]
+    if kind == 'posts':
+        rows = []
+        for index in range(start, start + size):
+            groups = STATE['group_ids']
+            rows.append((
+                STATE['first_post'] + index,
+                pick(rng, STATE['authors'], STATE['weights']),
+                rng.choice(groups) if groups and rng.random() < 0.7 else None,
+                faker.text(max_nb_chars=rng.choice((80, 200, 600, 1500))),
+                post_date(index) + rng.random() * STATE['step'],
+            ))
+        return rows
+    if kind == 'comments':
+        rows = []
+        posts = STATE['posts']
+        for index in range(start, start + size):
+            # Чаще обсуждают свежие посты: ранг 1 — самый новый.
+            post = posts - bisect(
+                STATE['recency'], rng.random() * STATE['recency'][-1]
+            ) - 1
+            created = min(
+                post_date(post) + timedelta(hours=rng.expovariate(1 / 12)),
+                STATE['now'],
+            )
+            rows.append((
+                STATE['first_comment'] + index,
+                STATE['first_post'] + post,
+                pick(rng, STATE['readers'], STATE['weights']),
+                faker.sentence(nb_words=rng.randint(3, 30)),
+                created,
+            ))
+        return rows
+    return [
+        (
+            pick(rng, STATE['readers'], STATE['weights']),
+            pick(rng, STATE['authors'], STATE['weights']),
+        )
+        for _ in range(size)
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет базу синтетическими пользователями, группами, постами, '
+        'комментариями и подписками для нагрузочных замеров. Число '
+        'подписчиков и постов у авторов и комментариев у постов '
+        'распределено по степенному закону (Ципфа), даты постов '
+        'растянуты на --days дней. Тексты генерирует Faker в нескольких '
+        'процессах, вставка идёт пачками bulk_create.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--groups', type=int, default=50)
+        parser.add_argument('--posts', type=int, default=100000)
+        parser.add_argument('--comments', type=int, default=200000)
+        parser.add_argument(
+            '--follows', type=int, default=100000,
+            help='Сколько подписок сгенерировать (повторы и подписки '
+                 'на себя отбрасываются).',
+        )
+        parser.add_argument(
+            '--alpha', type=float, default=1.1,
+            help='Показатель закона Ципфа: чем больше, тем сильнее '
+                 'перекос в сторону популярных авторов.',
+        )
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='За сколько дней до текущего момента публикуются посты.',
+        )
+        parser.add_argument(
+            '--processes', type=int, default=os.cpu_count(),
+            help='Процессы, генерирующие данные.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Количество записей в пачке генерации и вставки.',
+        )
+        parser.add_argument(
+            '--locale', default='ru_RU', help='Локаль Faker.',
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--prefix', default='seed-',
+            help='Префикс имён пользователей и адресов групп набора.',
+        )
+        parser.add_argument(
+            '--no-feeds', action='store_true',
+            help='Не заполнять ленты подписок — самый долгий этап: каждая '
+                 'подписка добавляет в ленту до POSTS_FEED_BACKFILL постов.',
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        prefix = options['prefix']
+        if options['users'] < 1:
+            raise CommandError('Нужен хотя бы один пользователь.')
+        if not options['posts']:
+            options['comments'] = 0
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(
+                f'Набор с префиксом {prefix} уже есть, выберите другой '
+                '--prefix.'
+            )
+        state = {
+            'seed': options['seed'],
+            'locale': options['locale'],
+            'prefix': prefix,
+        }
+        self.insert('users', options['users'], state, self.users)
+        users = list(
+            User.objects.filter(username__startswith=prefix)
+            .order_by('pk').values_list('pk', flat=True)
+        )
+        state.update(self.distributions(users))
+        self.insert('posts', options['posts'], state, self.posts)
+        self.insert('comments', options['comments'], state, self.comments)
+        self.insert('follows', options['follows'], state, self.follows)
+        reset_sequences(Post, Comment)
+        self.finish()
+
+    def distributions(self, users):
+        """Степенные распределения: популярность авторов (посты
+        и подписчики), активность читателей (подписки и комментарии)
+        и внимание к постам по их свежести.
+        """
+        options = self.options
+        rng = random.Random(options['seed'])
+        faker = Faker(options['locale'])
+        faker.seed_instance(options['seed'])
+        Group.objects.bulk_create(
+            Group(
+                title=f'{faker.word().capitalize()} {i}',
+                slug=f'{options["prefix"]}{i}',
+                description=faker.sentence(),
+            )
+            for i in range(options['groups'])
+        )
+        authors, readers = users[:], users[:]
+        rng.shuffle(authors)
+        rng.shuffle(readers)
+        weights = zipf_weights(len(users), options['alpha'])
+        now = timezone.now()
+        span = timedelta(days=options['days'])
+        return {
+            'authors': authors,
+            'readers': readers,
+            'weights': weights,
+            'recency': zipf_weights(max(options['posts'], 1), 1),
+            'group_ids': list(Group.objects.filter(
+                slug__startswith=options['prefix'],
+            ).values_list('pk', flat=True)),
+            'posts': max(options['posts'], 1),
+            'first_post': self.next_id(Post),
+            'first_comment': self.next_id(Comment),
+            'now': now,
+            'started': now - span,
+            'span': span,
+            'step': span / max(options['posts'], 1),
+        }
+
+    def next_id(self, model):
+        return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+    def generated(self, kind, total, state):
+        """Пачки строк kind: в пуле процессов или, если процесс
+        один, здесь же.
+        """
+        size = self.options['batch_size']
+        tasks = [
+            (kind, start, min(size, total - start))
+            for start in range(0, total, size)
+        ]
+        if self.options['processes'] <= 1:
+            init_worker(state)
+            yield from map(generate, tasks)
+            return
+        with Pool(
+            self.options['processes'], init_worker, (state,),
+        ) as pool:
+            yield from pool.imap(generate, tasks)
+
+    def insert(self, kind, total, state, insert_batch):
+        started = time.perf_counter()
+        for rows in self.generated(kind, total, state):
+            insert_batch(rows)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'{kind}: {total} за {elapsed:.1f} с '
+            f'({total / elapsed if elapsed else 0:.0f} записей/с)'
+        )
+
+    def users(self, rows):
+        password = make_password(None)
+        User.objects.bulk_create(
+            User(
+                username=username, first_name=first_name,
+                last_name=last_name, email=email, password=password,
+            )
+            for username, first_name, last_name, email in rows
+        )
+
+    def posts(self, rows):
+        posts = [
+            Post(id=pk, author_id=author_id, group_id=group_id, text=text)
+            for pk, author_id, group_id, text, _ in rows
+        ]
+        Post.objects.bulk_create(posts)
+        # bulk_create ставит pub_date текущим временем (auto_now_add).
+        for post, row in zip(posts, rows):
+            post.pub_date = row[-1]
+        Post.objects.bulk_update(posts, ['pub_date'])
+
+    def comments(self, rows):
+        comments = [
+            Comment(id=pk, post_id=post_id, author_id=author_id, text=text)
+            for pk, post_id, author_id, text, _ in rows
+        ]
+        Comment.objects.bulk_create(comments)
+        for comment, row in zip(comments, rows):
+            comment.created = row[-1]
+        Comment.objects.bulk_update(comments, ['created'])
+
+    def follows(self, rows):
+        Follow.objects.bulk_create(
+            (
+                Follow(user_id=user_id, author_id=author_id)
+                for user_id, author_id in set(rows)
+                if user_id != author_id
+            ),
+            ignore_conflicts=True,
+        )
+
+    def finish(self):
+        """Производные данные: счётчики, поисковый индекс, ленты
+        подписок, кэш лент и статистика планировщика.
+        """
+        options = self.options
+        call_command(
+            'rebuild_user_stats', batch_size=options['batch_size'],
+            stdout=self.stdout,
+        )
+        call_command(
+            'rebuild_search_index', batch_size=options['batch_size'],
+            stdout=self.stdout,
+        )
+        if not options['no_feeds']:
+            started = time.perf_counter()
+            follows = Follow.objects.filter(
+                user__username__startswith=options['prefix'],
+            ).values_list('user_id', 'author_id')
+            backfill_many(follows.iterator(chunk_size=options['batch_size']))
+            self.stdout.write(
+                f'Ленты подписок заполнены за '
+                f'{time.perf_counter() - started:.1f} с'
+            )
+        invalidate_counts('index', *(
+            f'group:{group_id}' for group_id in Group.objects.filter(
+                slug__startswith=options['prefix'],
+            ).values_list('pk', flat=True)
+        ))
+        bump_listings(ALL_LISTINGS)
+        if connection.vendor in ('sqlite', 'postgresql'):
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        self.stdout.write(self.style.SUCCESS('Готово'))
@@ -0,0 +1,34 @@
+# Generated by Django 2.2.16 on 2026-10-18 02:08
+
+from django.db import migrations, models
+import django.db.models.expressions
+
+
+def remove_self_follows(apps, schema_editor):
+    Follow = apps.get_model('posts', 'Follow')
+    UserStats = apps.get_model('posts', 'UserStats')
+    self_follows = Follow.objects.filter(
+        user_id=django.db.models.expressions.F('author_id')
+    )
+    user_ids = list(self_follows.values_list('user_id', flat=True))
+    self_follows.delete()
+    for user_id in user_ids:
+        UserStats.objects.filter(user_id=user_id).update(
+            following_count=Follow.objects.filter(user_id=user_id).count(),
+            followers_count=Follow.objects.filter(author_id=user_id).count(),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0016_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_self_follows, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='follow',
+            constraint=models.CheckConstraint(check=models.Q(_negated=True, user=django.db.models.expressions.F('author')), name='posts_follow_not_self'),
+        ),
+    ]
@@ -1,11 +1,24 @@
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, Q
 
 from .constants import SYMBOLS_PER_POST
+from .storage import ContentHashStorage
 from .validators import clean_text
 
 User = get_user_model()
 
+# Больше id в одном IN не передаётся: SQLite ограничивает число
+# параметров запроса.
+ID_BATCH_SIZE = 500
+
+
+def id_batches(ids):
+    """Список ids пачками не больше ID_BATCH_SIZE."""
+    ids = list(ids)
+    for start in range(0, len(ids), ID_BATCH_SIZE):
+        yield ids[start:start + ID_BATCH_SIZE]
+
 
 class Group(models.Model):
     """В базе данных создаётся модель для хранения информации о группах."""
@@ -35,6 +48,10 @@ class Post(models.Model):
         auto_now_add=True,
         verbose_name='Дата публикации',
     )
+    updated = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения',
+    )
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -53,18 +70,44 @@ class Post(models.Model):
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
+        storage=ContentHashStorage(),
         blank=True,
     )
 
     class Meta:
 
         ordering = ('-pub_date',)
+        indexes = [
+            models.Index(
+                fields=['author', '-pub_date'],
+                name='posts_post_author_date_idx',
+            ),
+            models.Index(
+                fields=['group', '-pub_date'],
+                name='posts_post_group_date_idx',
+            ),
+            models.Index(fields=['image'], name='posts_post_image_idx'),
+            models.Index(fields=['-pub_date'], name='posts_post_date_idx'),
+        ]
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
 
     def __str__(self):
         return self.text[:SYMBOLS_PER_POST]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Запоминает группу загруженного поста, чтобы при смене
+        группы сбросить кэш обеих лент, и его изображение, чтобы
+        при замене освободить старый файл.
+        """
+        instance = super().from_db(db, field_names, values)
+        if 'group_id' in field_names:
+            instance._loaded_group_id = instance.group_id
+        if 'image' in field_names:
+            instance._loaded_image = instance.image.name
+        return instance
+
 
 class Comment(models.Model):
     """В базе данных создаётся модель для хранения комментариев."""
@@ -95,6 +138,12 @@ class Comment(models.Model):
     class Meta:
 
         ordering = ('-created',)
+        indexes = [
+            models.Index(
+                fields=['post', '-created'],
+                name='posts_comment_post_date_idx',
+            ),
+        ]
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
 
@@ -102,6 +151,63 @@ class Comment(models.Model):
         return self.text[:SYMBOLS_PER_POST]
 
 
+class FollowManager(models.Manager):
+    """Идемпотентные подписка и отписка, защищённые ограничениями БД."""
+
+    def follow(self, user, author):
+        """Подписывает user на author одним INSERT. Повторная или
+        одновременная подписка упирается в уникальное ограничение
+        и ничего не меняет. Возвращает новое состояние подписки.
+        """
+        if user.pk == author.pk:
+            return False
+        try:
+            with transaction.atomic():
+                self.create(user=user, author=author)
+        except IntegrityError:
+            pass
+        return True
+
+    def unfollow(self, user, author):
+        """Отписывает user от author. Возвращает новое состояние."""
+        self.filter(user=user, author=author).delete()
+        return False
+
+    def bulk_follow(self, pairs, batch_size=None):
+        """Импортирует граф подписок из пар (user_id, author_id).
+
+        Вставка идёт пачками, существующие подписки и подписки на себя
+        пропускаются. Сигналы при этом не срабатывают, поэтому счётчики
+        участников пересчитываются, а ленты заполняются отдельно.
+        Возвращает количество переданных пар.
+        """
+        from .cache import bump_listings
+        from .feed import backfill_many
+
+        pairs = {
+            (user_id, author_id) for user_id, author_id in pairs
+            if user_id != author_id
+        }
+        self.bulk_create(
+            (
+                self.model(user_id=user_id, author_id=author_id)
+                for user_id, author_id in pairs
+            ),
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+        user_ids = list({user_id for pair in pairs for user_id in pair})
+        UserStats.objects.rebuild(user_ids)
+        backfill_many(pairs)
+        for batch in id_batches(user_ids):
+            bump_listings(*(
+                f'profile:{username}' for username in User.objects.filter(
+                    pk__in=batch,
+                ).values_list('username', flat=True)
+            ))
+        return len(pairs)
+
+
 class Follow(models.Model):
     """В базе данных создаётся модель для подписки на пользователей."""
 
@@ -118,7 +224,162 @@ class Follow(models.Model):
         verbose_name='подписка',
     )
 
+    objects = FollowManager()
+
     class Meta:
 
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'author'],
+                name='posts_follow_unique_user_author',
+            ),
+            models.CheckConstraint(
+                check=~Q(user=F('author')),
+                name='posts_follow_not_self',
+            ),
+        ]
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
+
+
+class UserStatsManager(models.Manager):
+    """Пересчитывает и обновляет счётчики пользователей."""
+
+    def rebuild(self, user_ids):
+        """Пересчитывает счётчики для пользователей с указанными id."""
+        stats = []
+        for batch in id_batches(user_ids):
+            stats.extend(self._rebuild(batch))
+        return stats
+
+    def _rebuild(self, user_ids):
+        posts = dict(
+            Post.objects.filter(author_id__in=user_ids)
+            .values_list('author_id').annotate(Count('id')).order_by()
+        )
+        followers = dict(
+            Follow.objects.filter(author_id__in=user_ids)
+            .values_list('author_id').annotate(Count('id')).order_by()
+        )
+        following = dict(
+            Follow.objects.filter(user_id__in=user_ids)
+            .values_list('user_id').annotate(Count('id')).order_by()
+        )
+        stats = [
+            self.model(
+                user_id=user_id,
+                posts_count=posts.get(user_id, 0),
+                followers_count=followers.get(user_id, 0),
+                following_count=following.get(user_id, 0),
+            )
+            for user_id in user_ids
+        ]
+        with transaction.atomic():
+            self.filter(user_id__in=user_ids).delete()
+            self.bulk_create(stats)
+        return stats
+
+    def increment(self, user_id, field, delta=1):
+        """Изменяет счётчик одним UPDATE. Если записи ещё нет,
+        при увеличении счётчика она пересчитывается целиком.
+        """
+        stats = self.filter(user_id=user_id)
+        if delta < 0:
+            stats = stats.filter(**{f'{field}__gte': -delta})
+        updated = stats.update(**{field: F(field) + delta})
+        if not updated and delta > 0:
+            self.rebuild([user_id])
+
+    def for_user(self, user):
+        """Отдаёт счётчики пользователя и кэширует их в user.stats."""
+        try:
+            return user.stats
+        except self.model.DoesNotExist:
+            user.stats = self.rebuild([user.pk])[0]
+            return user.stats
+
+
+class UserStats(models.Model):
+    """Денормализованные счётчики пользователя для карточки автора.
+
+    Поддерживаются сигналами при создании и удалении постов
+    и подписок, пересчитываются командой rebuild_user_stats.
+    """
+
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats',
+        verbose_name='пользователь',
+    )
+    posts_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='постов',
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='подписчиков',
+    )
+    following_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='подписок',
+    )
+
+    objects = UserStatsManager()
+
+    class Meta:
+
+        verbose_name = 'Статистика пользователя'
+        verbose_name_plural = 'Статистика пользователей'
+
+    def __str__(self):
+        return str(self.user_id)
+
+
+class FeedItem(models.Model):
+    """Запись материализованной ленты подписок пользователя.
+
+    Заполняется при публикации поста (fan-out on write) и при
+    подписке, удаляется при отписке. Дата публикации продублирована,
+    чтобы лента читалась по индексу (user, -pub_date).
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_items',
+        verbose_name='читатель',
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='feed_items',
+        verbose_name='пост',
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='автор',
+    )
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+
+    class Meta:
+
+        ordering = ('-pub_date',)
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date'], name='posts_feed_user_date_idx',
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'], name='posts_feed_unique_user_post',
+            ),
+        ]
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+
+    def __str__(self):
+        return f'{self.user_id}: {self.post_id}'
@@ -0,0 +1,245 @@
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.utils.module_loading import import_string
+
+from .models import Comment, Post
+
+WORD = re.compile(r'\w+')
+# Больше слов в запросе не учитывается.
+MAX_TERMS = 8
+
+
+def parse_query(query):
+    """Слова поискового запроса в нижнем регистре."""
+    return WORD.findall(query.lower())[:MAX_TERMS]
+
+
+class SearchBackend:
+    """Индекс полнотекстового поиска по постам и комментариям.
+
+    Бэкенд выбирается настройкой POSTS_SEARCH_BACKEND. Индекс
+    обновляется сигналами (см. signals.py) и перестраивается командой
+    rebuild_search_index.
+    """
+
+    def setup(self):
+        """Создаёт структуры индекса, если их ещё нет."""
+
+    def clear(self):
+        """Очищает индекс."""
+
+    def optimize(self):
+        """Уплотняет индекс после массового обновления."""
+
+    def index_posts(self, posts):
+        """Добавляет или обновляет посты в индексе."""
+
+    def remove_posts(self, post_ids):
+        """Удаляет посты из индекса."""
+
+    def index_comments(self, comments):
+        """Добавляет или обновляет комментарии в индексе."""
+
+    def remove_comments(self, comment_ids):
+        """Удаляет комментарии из индекса."""
+
+    def filter(self, queryset, terms):
+        """Оставляет в queryset постов найденные по словам terms."""
+        raise NotImplementedError
+
+    def count(self, terms):
+        """Количество найденных постов."""
+        raise NotImplementedError
+
+    def ranked_ids(self, terms, offset, limit):
+        """id найденных постов от самых релевантных."""
+        raise NotImplementedError
+
+
+class DatabaseBackend(SearchBackend):
+    """Поиск без индекса: LIKE по тексту постов (и комментариев),
+    новые посты выше. Подходит для небольших баз и любых СУБД.
+    """
+
+    def filter(self, queryset, terms):
+        for term in terms:
+            condition = Q(text__icontains=term)
+            if settings.POSTS_SEARCH_COMMENTS:
+                condition |= Q(pk__in=Comment.objects.filter(
+                    text__icontains=term,
+                ).values('post_id'))
+            queryset = queryset.filter(condition)
+        return queryset
+
+    def count(self, terms):
+        return self.filter(Post.objects.all(), terms).count()
+
+    def ranked_ids(self, terms, offset, limit):
+        return list(
+            self.filter(Post.objects.all(), terms)
+            .values_list('pk', flat=True)[offset:offset + limit]
+        )
+
+
+class SQLiteFTSBackend(SearchBackend):
+    """Инвертированный индекс SQLite FTS5. Посты и комментарии
+    хранятся в отдельных виртуальных таблицах (rowid — id записи),
+    релевантность — BM25; совпадения в комментариях весят
+    POSTS_SEARCH_COMMENT_WEIGHT от совпадений в тексте поста.
+    """
+
+    POSTS_TABLE = 'posts_post_fts'
+    COMMENTS_TABLE = 'posts_comment_fts'
+    TOKENIZE = 'unicode61 remove_diacritics 2'
+
+    def setup(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {self.POSTS_TABLE} '
+                f"USING fts5(text, tokenize='{self.TOKENIZE}')"
+            )
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {self.COMMENTS_TABLE} '
+                f'USING fts5(text, post_id UNINDEXED, '
+                f"tokenize='{self.TOKENIZE}')"
+            )
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            for table in (self.POSTS_TABLE, self.COMMENTS_TABLE):
+                cursor.execute(f'DELETE FROM {table}')
+
+    def optimize(self):
+        with connection.cursor() as cursor:
+            for table in (self.POSTS_TABLE, self.COMMENTS_TABLE):
+                cursor.execute(
+                    f"INSERT INTO {table}({table}) VALUES ('optimize')"
+                )
+
+    def index_posts(self, posts):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT OR REPLACE INTO {self.POSTS_TABLE}(rowid, text) '
+                'VALUES (%s, %s)',
+                [(post.pk, post.text) for post in posts],
+            )
+
+    def remove_posts(self, post_ids):
+        self._delete(self.POSTS_TABLE, post_ids)
+
+    def index_comments(self, comments):
+        if not settings.POSTS_SEARCH_COMMENTS:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT OR REPLACE INTO {self.COMMENTS_TABLE}'
+                '(rowid, text, post_id) VALUES (%s, %s, %s)',
+                [
+                    (comment.pk, comment.text, comment.post_id)
+                    for comment in comments
+                ],
+            )
+
+    def remove_comments(self, comment_ids):
+        self._delete(self.COMMENTS_TABLE, comment_ids)
+
+    def _delete(self, table, ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {table} WHERE rowid = %s',
+                [(pk,) for pk in ids],
+            )
+
+    def _match(self, terms):
+        """Выражение MATCH: все слова, каждое — как префикс."""
+        return ' '.join(f'"{term}"*' for term in terms)
+
+    def _matches(self, terms):
+        """Подзапрос (post_id, score) по постам и комментариям;
+        меньший score — более релевантный.
+        """
+        match = self._match(terms)
+        sql = (
+            f'SELECT rowid AS post_id, bm25({self.POSTS_TABLE}) AS score '
+            f'FROM {self.POSTS_TABLE} WHERE {self.POSTS_TABLE} MATCH %s'
+        )
+        params = [match]
+        if settings.POSTS_SEARCH_COMMENTS:
+            sql += (
+                f' UNION ALL SELECT post_id, '
+                f'bm25({self.COMMENTS_TABLE}) * %s '
+                f'FROM {self.COMMENTS_TABLE} '
+                f'WHERE {self.COMMENTS_TABLE} MATCH %s'
+            )
+            params += [settings.POSTS_SEARCH_COMMENT_WEIGHT, match]
+        return sql, params
+
+    def filter(self, queryset, terms):
+        sql, params = self._matches(terms)
+        # pk__in=RawSQL(...) оборачивает подзапрос во вторые скобки,
+        # и SQLite берёт из него только первую строку.
+        meta = queryset.model._meta
+        column = f'"{meta.db_table}"."{meta.pk.column}"'
+        return queryset.extra(
+            where=[f'{column} IN (SELECT post_id FROM ({sql}))'],
+            params=params,
+        )
+
+    def count(self, terms):
+        sql, params = self._matches(terms)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT COUNT(DISTINCT post_id) FROM ({sql})', params,
+            )
+            return cursor.fetchone()[0]
+
+    def ranked_ids(self, terms, offset, limit):
+        sql, params = self._matches(terms)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT post_id FROM ({sql}) GROUP BY post_id '
+                'ORDER BY MIN(score), post_id DESC LIMIT %s OFFSET %s',
+                params + [limit, offset],
+            )
+            return [post_id for post_id, in cursor.fetchall()]
+
+
+def get_backend():
+    """Бэкенд поиска из настройки POSTS_SEARCH_BACKEND."""
+    return import_string(settings.POSTS_SEARCH_BACKEND)()
+
+
+class SearchResults:
+    """Найденные посты в порядке релевантности.
+
+    Поддерживает count() и срезы, поэтому подходит для Paginator:
+    поиск выполняется только для запрошенной страницы.
+    """
+
+    def __init__(self, query, backend=None):
+        self.terms = parse_query(query)
+        self.backend = backend or get_backend()
+
+    @cached_property
+    def _count(self):
+        return self.backend.count(self.terms) if self.terms else 0
+
+    def count(self):
+        return self._count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        start = key.start or 0
+        if not self.terms or key.stop is None or key.stop <= start:
+            return []
+        ids = self.backend.ranked_ids(self.terms, start, key.stop - start)
+        posts = Post.objects.select_related('author', 'group').in_bulk(ids)
+        return [posts[pk] for pk in ids if pk in posts]
@@ -0,0 +1,141 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import feed, search
+from .cache import (ALL_LISTINGS, bump_listings, invalidate_counts,
+                    post_count_scopes, post_listing_scopes)
+from .models import Comment, Follow, Group, Post, User, UserStats
+from .thumbnails import release_image
+
+
+def bump_post_listings(post, group_ids):
+    """Сбрасывает кэш страниц лент, в которых показывается пост."""
+    group_slugs = Group.objects.filter(
+        pk__in=[group_id for group_id in group_ids if group_id is not None]
+    ).values_list('slug', flat=True)
+    bump_listings(*post_listing_scopes(post, group_slugs))
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    """Обновляет счётчики, ленты подписок и кэш страниц лент.
+    Количество постов в лентах сбрасывается только при создании
+    поста или смене его группы. Заменённое изображение освобождается,
+    текст поста переиндексируется для поиска.
+    """
+    search.get_backend().index_posts([instance])
+    if created:
+        UserStats.objects.increment(instance.author_id, 'posts_count')
+        feed.fan_out(instance)
+    loaded_image = getattr(instance, '_loaded_image', None)
+    instance._loaded_image = instance.image.name
+    if loaded_image != instance.image.name:
+        release_image(loaded_image)
+    initial_group_id = getattr(instance, '_loaded_group_id', None)
+    instance._loaded_group_id = instance.group_id
+    group_ids = (initial_group_id, instance.group_id)
+    bump_post_listings(instance, group_ids)
+    if not created and initial_group_id == instance.group_id:
+        return
+    invalidate_counts(*post_count_scopes(instance, group_ids))
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    """При удалении поста обновляет счётчики автора, сбрасывает
+    количества постов и кэш страниц его лент, освобождает изображение
+    и убирает пост из поиска.
+    """
+    search.get_backend().remove_posts([instance.pk])
+    UserStats.objects.increment(instance.author_id, 'posts_count', -1)
+    release_image(instance.image.name)
+    invalidate_counts(*post_count_scopes(instance, (instance.group_id,)))
+    bump_post_listings(instance, (instance.group_id,))
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, **kwargs):
+    """Индексирует текст комментария для поиска."""
+    search.get_backend().index_comments([instance])
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    """Убирает комментарий из поиска."""
+    search.get_backend().remove_comments([instance.pk])
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    """Группа показывается в карточках постов всех лент, поэтому её
+    изменение сбрасывает кэш всех страниц лент.
+    """
+    bump_listings(ALL_LISTINGS)
+
+
+# Поля пользователя, которые выводятся в карточках постов.
+CARD_USER_FIELDS = ('username', 'first_name', 'last_name')
+
+
+@receiver(pre_save, sender=User)
+def user_changing(sender, instance, raw=False, update_fields=None,
+                  **kwargs):
+    """Запоминает, меняются ли имя и адрес профиля пользователя.
+    Сохранения только других полей (например, last_login при входе)
+    не проверяются.
+    """
+    instance._card_changed = False
+    if raw or instance.pk is None:
+        return
+    if update_fields is not None and not (
+        set(update_fields) & set(CARD_USER_FIELDS)
+    ):
+        return
+    saved = User.objects.filter(pk=instance.pk).values_list(
+        *CARD_USER_FIELDS
+    ).first()
+    instance._card_changed = saved is not None and saved != tuple(
+        getattr(instance, field) for field in CARD_USER_FIELDS
+    )
+
+
+@receiver(post_save, sender=User)
+def user_created(sender, instance, created, raw=False, **kwargs):
+    """Заводит счётчики новому пользователю. Смена имени или адреса
+    профиля сбрасывает кэш всех лент и карточек постов.
+    """
+    if created and not raw:
+        UserStats.objects.get_or_create(user=instance)
+    if getattr(instance, '_card_changed', False):
+        bump_listings(ALL_LISTINGS)
+
+
+def bump_follow_listings(follow):
+    """Подписка меняет карточки автора и читателя в их профилях."""
+    bump_listings(
+        f'profile:{follow.author.username}', f'profile:{follow.user.username}'
+    )
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    """Увеличивает счётчики подписчиков автора и подписок читателя
+    и добавляет посты автора в ленту читателя.
+    """
+    if created:
+        UserStats.objects.increment(instance.author_id, 'followers_count')
+        UserStats.objects.increment(instance.user_id, 'following_count')
+        feed.backfill(instance.user_id, instance.author_id)
+        bump_follow_listings(instance)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    """Уменьшает счётчики подписчиков автора и подписок читателя
+    и убирает посты автора из ленты читателя.
+    """
+    UserStats.objects.increment(instance.author_id, 'followers_count', -1)
+    UserStats.objects.increment(instance.user_id, 'following_count', -1)
+    feed.prune(instance.user_id, instance.author_id)
+    bump_follow_listings(instance)
@@ -0,0 +1,72 @@
+import hashlib
+import os
+import posixpath
+import time
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentHashStorage(FileSystemStorage):
+    """Файловое хранилище с именами по хэшу содержимого.
+
+    Файл сохраняется как <каталог>/<2 символа хэша>/<sha256>.<расш.>,
+    поэтому одинаковые загрузки ложатся в один файл, а миниатюры sorl,
+    ключ которых строится по имени исходника, создаются один раз.
+    Удалять файл можно, только когда на него не ссылается ни один пост
+    (см. thumbnails.release_image), и только через discard: ссылка
+    из повторной загрузки может быть ещё не зафиксирована.
+    """
+
+    def content_name(self, name, content):
+        """Имя файла по SHA-256 его содержимого. Хэш, посчитанный
+        при загрузке (uploads.StreamedImage.sha256), не пересчитывается.
+        """
+        hexdigest = getattr(content, 'sha256', None)
+        if hexdigest is None:
+            digest = hashlib.sha256()
+            content.seek(0)
+            for chunk in content.chunks():
+                digest.update(chunk)
+            content.seek(0)
+            hexdigest = digest.hexdigest()
+        directory, filename = posixpath.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        return posixpath.join(
+            directory, hexdigest[:2], f'{hexdigest}{extension}',
+        )
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.content_name(name, content)
+        try:
+            # Отметка о повторном использовании, см. discard.
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            return super().save(name, content, max_length=max_length)
+        return name
+
+    def discard(self, name, min_age):
+        """Удаляет файл, если его не загружали повторно последние
+        min_age секунд. Файл сначала убирается из-под своего имени,
+        поэтому одновременная загрузка либо успевает обновить время
+        изменения и файл возвращается на место, либо не находит его
+        и записывает заново. Возвращает, удалён ли файл.
+        """
+        path = self.path(name)
+        directory, filename = os.path.split(path)
+        discarded = os.path.join(directory, f'.discard-{filename}')
+        try:
+            os.rename(path, discarded)
+        except FileNotFoundError:
+            return False
+        if time.time() - os.stat(discarded).st_mtime < min_age:
+            os.replace(discarded, path)
+            return False
+        os.remove(discarded)
+        return True
@@ -0,0 +1,18 @@
+from django import template
+from django.conf import settings
+
+from ..cache import cards_version as get_cards_version
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def cards_version(context):
+    """Версия для ключа кэша карточки поста (см. cache.cards_version)."""
+    return get_cards_version(context['request'])
+
+
+@register.simple_tag
+def card_timeout():
+    """Время хранения карточки поста в кэше."""
+    return settings.POSTS_CARD_CACHE_TIMEOUT
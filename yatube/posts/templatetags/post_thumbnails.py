@@ -0,0 +1,41 @@
+from django import template
+
+from ..thumbnails import (CARD_GEOMETRY, CARD_WIDTHS, MODERN_FORMATS,
+                          card_variant, ready_thumbnails)
+
+register = template.Library()
+
+
+@register.inclusion_tag('posts/includes/post_picture.html')
+def post_picture(post):
+    """Изображение поста: <picture> с вариантами в современных
+    форматах разной ширины и миниатюрой в исходном формате.
+
+    Миниатюры берутся найденными заранее (warm_thumbnails) или из
+    хранилища ключей sorl; файлы не проверяются и задачи не ставятся.
+    Пока нет основной миниатюры, показывается заглушка.
+    """
+    thumbnails = ready_thumbnails(
+        post.image, getattr(post, '_thumbnails', None),
+    )
+    sources = []
+    for format_ in MODERN_FORMATS:
+        srcset = ', '.join(
+            f'{thumbnail.url} {thumbnail.width}w'
+            for thumbnail in (
+                thumbnails[card_variant(format_, width)]
+                for width in CARD_WIDTHS
+            )
+            if thumbnail is not None
+        )
+        if srcset:
+            sources.append({
+                'type': f'image/{format_.lower()}', 'srcset': srcset,
+            })
+    return {
+        'post': post,
+        'image': thumbnails['card'],
+        'sources': sources,
+        'width': CARD_GEOMETRY[0],
+        'height': CARD_GEOMETRY[1],
+    }
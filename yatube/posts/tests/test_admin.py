@@ -0,0 +1,83 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ..admin import PostAdmin
+from ..models import Group, Post
+from ..search import get_backend
+
+User = get_user_model()
+
+
+class PostAdminChangeListTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(
+            username='Admin', email='admin@example.com', password='-',
+        )
+        cls.group = Group.objects.create(
+            title='Группа', slug='admin-group', description='-',
+        )
+        cls.url = reverse('admin:posts_post_changelist')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def create_posts(self, count):
+        Post.objects.bulk_create(
+            Post(text=f'Пост {i}', author=self.admin, group=self.group)
+            for i in range(count)
+        )
+
+    def changelist_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response, [query['sql'] for query in context.captured_queries]
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        """Число запросов списка постов не зависит от числа строк,
+        группа выбирается автодополнением, а не списком всех групп,
+        а количество постов считается один раз и с ограничением.
+        """
+        self.create_posts(2)
+        _, few = self.changelist_queries()
+        self.create_posts(20)
+        response, many = self.changelist_queries()
+        self.assertEqual(len(many), len(few))
+        counts = [sql for sql in many if 'COUNT(' in sql]
+        self.assertEqual(len(counts), 1)
+        self.assertIn('LIMIT', counts[0])
+        self.assertContains(response, 'admin-autocomplete')
+
+    def test_changelist_search_finds_all_matches(self):
+        """Поиск в списке постов находит все посты со словом."""
+        get_backend().clear()
+        for i in range(3):
+            Post.objects.create(text=f'Привет {i}', author=self.admin)
+        Post.objects.create(text='Пока', author=self.admin)
+        response = self.client.get(self.url, {'q': 'привет'})
+        self.assertEqual(response.context['cl'].result_count, 3)
+        self.assertEqual(
+            get_backend().filter(Post.objects.all(), ['привет']).count(), 3,
+        )
+
+    @override_settings(POSTS_ADMIN_COUNT_LIMIT=3)
+    def test_changelist_count_is_capped(self):
+        """Количество постов считается не дальше границы после текущей
+        страницы и показывается как нижняя граница; ссылки на следующие
+        страницы остаются, на последней странице количество точное.
+        """
+        self.create_posts(10)
+        with mock.patch.object(PostAdmin, 'list_per_page', 2):
+            response = self.client.get(self.url)
+            self.assertEqual(response.context['cl'].result_count, 5)
+            self.assertContains(response, '5+ Посты')
+            self.assertContains(response, '?p=2')
+            response = self.client.get(self.url, {'p': 3})
+            self.assertEqual(response.context['cl'].result_count, 10)
+            self.assertNotContains(response, '10+')
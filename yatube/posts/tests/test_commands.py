@@ -0,0 +1,241 @@
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from sorl.thumbnail import default
+
+from ..models import Comment, FeedItem, Follow, Group, Post, UserStats
+from ..search import get_backend
+from ..thumbnails import (create_thumbnails, ready_thumbnails,
+                          register_thumbnails)
+from .test_images import make_jpeg
+
+User = get_user_model()
+
+
+class BenchmarkIndexesCommandTest(TransactionTestCase):
+    def test_benchmark_indexes_rolls_back(self):
+        """Замер выводит планы запросов и не оставляет данных в базе."""
+        out = StringIO()
+        call_command(
+            'benchmark_indexes', users=5, groups=2, posts=50, comments=50,
+            follows=10, repeat=1, stdout=out,
+        )
+        self.assertIn('posts_post_author_date_idx', out.getvalue())
+        self.assertFalse(Post.objects.exists())
+
+
+class BenchmarkViewsCommandTest(TransactionTestCase):
+    def test_benchmark_views_writes_report(self):
+        """Замер страниц заполняет базу командой seed и сохраняет
+        отчёт с процентилями задержек по каждой странице.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'report.json')
+            call_command(
+                'benchmark_views', users=10, groups=2, posts=50,
+                comments=20, follows_per_user=3, readers=2, requests=5,
+                warmup=1, transports=['client'], output=output,
+                processes=1, stdout=StringIO(),
+            )
+            with open(output, encoding='utf-8') as file:
+                report = json.load(file)
+        # Данные замера остаются в базе и не мешают benchmark_indexes.
+        call_command(
+            'benchmark_indexes', users=5, groups=2, posts=50, comments=50,
+            follows=10, repeat=1, stdout=StringIO(),
+        )
+        self.assertEqual(report['meta']['dataset']['posts'], 50)
+        self.assertEqual(
+            [result['view'] for result in report['results']],
+            ['index', 'group_posts', 'profile', 'post_detail',
+             'follow_index', 'add_comment'],
+        )
+        for result in report['results']:
+            with self.subTest(view=result['view']):
+                self.assertEqual(result['errors'], 0)
+                self.assertLessEqual(result['p50'], result['p99'])
+
+
+class ContentTransferCommandTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='writer')
+        self.reader = User.objects.create_user(username='reader')
+        group = Group.objects.create(
+            title='Сад', slug='garden', description='Про сад',
+        )
+        self.post = Post.objects.create(
+            text='Яблоки поспели', author=self.author, group=group,
+        )
+        self.pub_date = datetime(2020, 5, 1, 12, tzinfo=timezone.utc)
+        Post.objects.filter(pk=self.post.pk).update(pub_date=self.pub_date)
+        Comment.objects.create(
+            post=self.post, author=self.reader, text='Вкусные?',
+        )
+        Follow.objects.follow(self.reader, self.author)
+
+    def wipe(self):
+        User.objects.all().delete()
+        Group.objects.all().delete()
+
+    def test_export_import_round_trip(self):
+        """Выгрузка и загрузка сохраняют записи, их id и даты,
+        а также обновляют поиск, ленты и счётчики.
+        """
+        for fmt in ('jsonl', 'csv'):
+            with self.subTest(format=fmt), \
+                    tempfile.TemporaryDirectory() as directory:
+                call_command(
+                    'export_content', directory, format=fmt, batch_size=1,
+                    stdout=StringIO(),
+                )
+                self.wipe()
+                call_command(
+                    'import_content', directory, format=fmt, batch_size=1,
+                    stdout=StringIO(),
+                )
+                post = Post.objects.get(pk=self.post.pk)
+                self.assertEqual(post.text, 'Яблоки поспели')
+                self.assertEqual(post.group.slug, 'garden')
+                self.assertEqual(post.pub_date, self.pub_date)
+                self.assertEqual(post.comments.get().author.username, 'reader')
+                self.assertTrue(Follow.objects.filter(
+                    user__username='reader', author=post.author,
+                ).exists())
+                self.assertTrue(FeedItem.objects.filter(post=post).exists())
+                self.assertEqual(post.author.stats.posts_count, 1)
+                self.assertEqual(get_backend().count(['яблоки']), 1)
+
+    def test_import_validates_texts(self):
+        """Строки с пустым текстом или неразборчивым JSON отменяют
+        загрузку или, с флагом --skip-invalid, пропускаются вместе
+        с их авторами.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, 'posts.jsonl'), 'w') as file:
+                for author, text in (('newcomer', 'Новый пост'),
+                                     ('ghost', '')):
+                    file.write(json.dumps({
+                        'author': author, 'text': text,
+                        'pub_date': '2021-01-01T00:00:00+00:00',
+                    }) + '\n')
+                file.write('{"author": "broken"\n')
+            with self.assertRaisesMessage(CommandError, 'posts:2'):
+                call_command('import_content', directory, stdout=StringIO())
+            self.assertFalse(User.objects.filter(username='newcomer').exists())
+            stderr = StringIO()
+            call_command(
+                'import_content', directory, skip_invalid=True,
+                stdout=StringIO(), stderr=stderr,
+            )
+        self.assertIn('posts:3: неверный JSON', stderr.getvalue())
+        self.assertFalse(User.objects.filter(username='ghost').exists())
+        post = Post.objects.get(author__username='newcomer')
+        self.assertEqual(post.text, 'Новый пост')
+        self.assertGreater(post.pk, self.post.pk)
+
+
+class SeedCommandTest(TestCase):
+    def test_seed_generates_skewed_dataset(self):
+        """Генератор создаёт заданное число записей; посты и подписчики
+        сосредоточены у немногих авторов, даты постов растянуты.
+        """
+        call_command(
+            'seed', users=30, groups=3, posts=300, comments=100,
+            follows=200, days=30, processes=2, batch_size=50,
+            stdout=StringIO(),
+        )
+        self.assertEqual(User.objects.count(), 30)
+        self.assertEqual(Group.objects.count(), 3)
+        self.assertEqual(Post.objects.count(), 300)
+        self.assertEqual(Comment.objects.count(), 100)
+        self.assertTrue(Follow.objects.exists())
+        top = UserStats.objects.order_by('-posts_count').first()
+        self.assertGreater(top.posts_count, 300 / 30 * 3)
+        dates = list(Post.objects.values_list('pub_date', flat=True))
+        self.assertGreater((max(dates) - min(dates)).days, 25)
+        self.assertTrue(FeedItem.objects.exists())
+        with self.assertRaisesMessage(CommandError, 'seed-'):
+            call_command('seed', users=1, stdout=StringIO())
+
+
+class BenchmarkImagesCommandTest(TestCase):
+    def test_benchmark_images_command(self):
+        """Команда замеров обрабатывает синтетический набор."""
+        out = StringIO()
+        call_command(
+            'benchmark_images', count=2, size='400x300', workers=0,
+            stdout=out,
+        )
+        self.assertIn('изображений/с', out.getvalue())
+
+
+class MediaGarbageTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        author = User.objects.create_user(username='Collector')
+        self.post = Post.objects.create(
+            text='Живой пост',
+            author=author,
+            image=SimpleUploadedFile(
+                'live.jpg', make_jpeg((1200, 800)), 'image/jpeg',
+            ),
+        )
+        create_thumbnails(self.post.image)
+        register_thumbnails(self.post.image)
+        self.thumbnails = ready_thumbnails(self.post.image)
+        storage = self.post.image.storage
+        self.orphan = storage.save(
+            'posts/orphan.jpg', ContentFile(make_jpeg((100, 100))),
+        )
+        self.orphan_thumbnail = default.storage.save(
+            'cache/00/00/orphan.jpg', ContentFile(b'thumbnail'),
+        )
+
+    def collect(self, **options):
+        out = StringIO()
+        call_command(
+            'collect_media_garbage', min_age=0, stdout=out, **options,
+        )
+        return out.getvalue()
+
+    def test_dry_run_deletes_nothing(self):
+        """Пробный запуск только считает осиротевшие файлы."""
+        out = self.collect(dry_run=True)
+        self.assertIn('Исходные изображения: просмотрено 2, к удалению 1',
+                      out)
+        self.assertIn('Пробный запуск', out)
+        self.assertTrue(self.post.image.storage.exists(self.orphan))
+        self.assertTrue(default.storage.exists(self.orphan_thumbnail))
+
+    def test_orphans_deleted_live_files_kept(self):
+        """Удаляются изображения без постов, чужие миниатюры
+        и записи о пропавших файлах; файлы живого поста остаются.
+        """
+        stale = self.thumbnails['card']
+        os.remove(stale.storage.path(stale.name))
+        self.collect()
+        self.assertFalse(self.post.image.storage.exists(self.orphan))
+        self.assertFalse(default.storage.exists(self.orphan_thumbnail))
+        self.assertTrue(
+            self.post.image.storage.exists(self.post.image.name)
+        )
+        self.assertIsNone(default.kvstore.get(stale))
+        for size, thumbnail in self.thumbnails.items():
+            if size != 'card':
+                self.assertTrue(thumbnail.exists())
@@ -1,5 +1,8 @@
+import hashlib
+import os
 import shutil
 import tempfile
+from unittest import mock
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
@@ -16,7 +19,7 @@ User = get_user_model()
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
 
-@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, POSTS_THUMBNAIL_WORKERS=0)
 class PostCreateFormTests(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -39,6 +42,7 @@ class PostCreateFormTests(TestCase):
             content=small_gif,
             content_type='image/gif',
         )
+        cls.small_gif = small_gif
         cls.uploaded = uploaded
         cls.uploaded_edit = uploaded_edit
         cls.author = User.objects.create_user(username='Authornew')
@@ -77,8 +81,9 @@ class PostCreateFormTests(TestCase):
             first_object.author, form_data['author']
         )
         self.assertEqual(first_object.group.id, form_data['group'])
+        digest = hashlib.sha256(self.small_gif).hexdigest()
         self.assertEqual(
-            first_object.image.name, f"posts/{form_data['image'].name}"
+            first_object.image.name, f'posts/{digest[:2]}/{digest}.gif'
         )
 
     def test_authorized_user_creates_post(self):
@@ -102,6 +107,67 @@ class PostCreateFormTests(TestCase):
         self.assertEqual(Post.objects.count(), post_count + 1)
         self.body_test(first_object, form_data)
 
+    def test_post_create_schedules_thumbnails(self):
+        """После создания поста миниатюры ставятся в очередь."""
+        uploaded = SimpleUploadedFile(
+            name='queued.gif',
+            content=self.small_gif,
+            content_type='image/gif',
+        )
+        with mock.patch('posts.views.schedule_thumbnails') as schedule:
+            self.authorized_author.post(
+                reverse('posts:post_create'),
+                data={'text': 'Пост с картинкой', 'image': uploaded},
+            )
+        schedule.assert_called_once_with(Post.objects.first())
+
+    @override_settings(POSTS_IMAGE_MAX_SIZE=32)
+    def test_post_create_rejects_large_and_broken_images(self):
+        """Слишком большой файл и не изображение отклоняются
+        при загрузке, временные файлы не остаются в хранилище.
+        """
+        uploads = {
+            'file_too_large': SimpleUploadedFile(
+                'large.gif', self.small_gif + b'\0' * 64, 'image/gif',
+            ),
+            'invalid_image': SimpleUploadedFile(
+                'broken.gif', b'not an image', 'image/gif',
+            ),
+        }
+        post_count = Post.objects.count()
+        for code, uploaded in uploads.items():
+            with self.subTest(code=code):
+                response = self.authorized_author.post(
+                    reverse('posts:post_create'),
+                    data={'text': 'Пост с картинкой', 'image': uploaded},
+                )
+                form = response.context['form']
+                self.assertTrue(form.has_error('image', code))
+        self.assertEqual(Post.objects.count(), post_count)
+        uploads_dir = os.path.join(TEMP_MEDIA_ROOT, 'posts')
+        if os.path.isdir(uploads_dir):
+            self.assertFalse([
+                name for name in os.listdir(uploads_dir)
+                if name.startswith('.upload-')
+            ])
+
+    def test_post_create_rejects_corrupt_header(self):
+        """Изображение с битым заголовком отклоняется ошибкой формы."""
+        uploaded = SimpleUploadedFile(
+            'broken.bmp',
+            b'BM' + b'\0' * 12 + b'\x02\x00\x00\x00' + b'\0' * 8,
+            'image/bmp',
+        )
+        post_count = Post.objects.count()
+        response = self.authorized_author.post(
+            reverse('posts:post_create'),
+            data={'text': 'Пост с картинкой', 'image': uploaded},
+        )
+        self.assertTrue(
+            response.context['form'].has_error('image', 'invalid_image'),
+        )
+        self.assertEqual(Post.objects.count(), post_count)
+
     def test_authorized_user_edits_post(self):
         """Валидная форма редактирует запись в Post
         для авторизованного пользователя.
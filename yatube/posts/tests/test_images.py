@@ -0,0 +1,148 @@
+import os
+import shutil
+import tempfile
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, TransactionTestCase, override_settings
+from PIL import Image
+from sorl.thumbnail.images import ImageFile
+
+from ..image_pipeline import (ORIENTATION_TAG, ImageRejected, Target,
+                              process_image)
+from ..models import Post
+from ..thumbnails import (create_thumbnails, delete_image, ready_thumbnail,
+                          register_thumbnails, run_pipeline)
+
+User = get_user_model()
+
+CARD = Target(960, 339, True, True, 'JPEG', 85, True)
+
+
+def make_jpeg(size, orientation=None):
+    image = Image.new('RGB', size, 'red')
+    exif = Image.Exif()
+    exif[0x010F] = 'Camera'
+    if orientation is not None:
+        exif[ORIENTATION_TAG] = orientation
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+class ImagePipelineTest(TestCase):
+    def test_thumbnail_size_and_metadata(self):
+        """Миниатюра получает точный размер, а метаданные исходника
+        (EXIF) в неё не попадают.
+        """
+        (content, size), = process_image(
+            make_jpeg((3000, 2000)), [CARD], max_pixels=None,
+        )
+        self.assertEqual(size, (960, 339))
+        thumbnail = Image.open(BytesIO(content))
+        self.assertEqual(thumbnail.size, (960, 339))
+        self.assertNotIn('exif', thumbnail.info)
+
+    def test_orientation_applied_before_resize(self):
+        """Повёрнутое по EXIF изображение вписывается в миниатюру
+        с учётом поворота.
+        """
+        target = CARD._replace(crop=False)
+        (_, size), = process_image(
+            make_jpeg((2000, 1000), orientation=6), [target], max_pixels=None,
+        )
+        self.assertEqual(size, (170, 339))
+
+    def test_rejected_images(self):
+        """Слишком большие и повреждённые изображения отклоняются."""
+        sources = {
+            'пикселей': (make_jpeg((200, 100)), 10000),
+            'не изображение': (b'not an image', None),
+        }
+        for name, (source, max_pixels) in sources.items():
+            with self.subTest(name=name):
+                with self.assertRaises(ImageRejected):
+                    process_image(source, [CARD], max_pixels)
+
+    def test_formats_opened_by_pillow_are_accepted(self):
+        """Принимаются все форматы, которые открывает Pillow,
+        как и в ImageField, а не только форматы веба.
+        """
+        for format_, mode in (('BMP', 'RGB'), ('TIFF', 'I;16')):
+            with self.subTest(format=format_):
+                buffer = BytesIO()
+                Image.new(mode, (1200, 800)).save(buffer, format_)
+                (_, size), = process_image(
+                    buffer.getvalue(), [CARD], max_pixels=None,
+                )
+                self.assertEqual(size, (960, 339))
+
+    def test_missing_file_is_not_rejected(self):
+        """Ошибка чтения файла не выдаётся за отклонённое изображение."""
+        with self.assertRaises(FileNotFoundError):
+            process_image('/nonexistent/image.jpg', [CARD], None)
+
+    @override_settings(POSTS_IMAGE_WORKERS=1)
+    def test_run_pipeline_in_process_pool(self):
+        """Миниатюры строятся в процессе пула."""
+        (_, size), = run_pipeline(make_jpeg((1200, 800)), [CARD])
+        self.assertEqual(size, (960, 339))
+
+
+class ContentHashStorageTest(TransactionTestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.author = User.objects.create_user(username='Reposter')
+
+    def create_post(self, content):
+        return Post.objects.create(
+            text='Пост с картинкой',
+            author=self.author,
+            image=SimpleUploadedFile('photo.jpg', content, 'image/jpeg'),
+        )
+
+    @override_settings(POSTS_IMAGE_REUSE_GRACE=0)
+    def test_identical_uploads_share_file_until_last_post(self):
+        """Одинаковые загрузки хранятся одним файлом с общими
+        миниатюрами; файл удаляется вместе с последним постом.
+        """
+        content = make_jpeg((1200, 800))
+        first = self.create_post(content)
+        second = self.create_post(content)
+        other = self.create_post(make_jpeg((1200, 800), orientation=3))
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertNotEqual(first.image.name, other.image.name)
+        create_thumbnails(first.image)
+        register_thumbnails(first.image)
+        thumbnail = ready_thumbnail(second.image)
+        self.assertIsNotNone(thumbnail)
+
+        first.delete()
+        self.assertTrue(second.image.storage.exists(second.image.name))
+        second.delete()
+        self.assertFalse(second.image.storage.exists(second.image.name))
+        self.assertFalse(thumbnail.exists())
+        self.assertTrue(other.image.storage.exists(other.image.name))
+
+    def test_reused_file_survives_release(self):
+        """Файл, только что загруженный повторно, не удаляется
+        освобождением изображения другого поста, пока ссылка на него
+        может быть не зафиксирована.
+        """
+        content = make_jpeg((1200, 800))
+        first = self.create_post(content)
+        storage = first.image.storage
+        path = storage.path(first.image.name)
+        os.utime(path, (0, 0))
+        self.create_post(content)
+        self.assertFalse(delete_image(ImageFile(first.image.name, storage)))
+        self.assertTrue(storage.exists(first.image.name))
+        os.utime(path, (0, 0))
+        self.assertTrue(delete_image(ImageFile(first.image.name, storage)))
+        self.assertFalse(storage.exists(first.image.name))
@@ -1,8 +1,14 @@
+from io import StringIO
+from unittest import mock
+
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import IntegrityError
 from django.test import TestCase
 
+from ..cache import listing_versions
 from ..constants import SYMBOLS_PER_POST
-from ..models import Group, Post
+from ..models import FeedItem, Follow, Group, Post, UserStats
 
 User = get_user_model()
 
@@ -65,3 +71,105 @@ class PostModelTest(TestCase):
                     expected_value,
                     'Ошибка help_text, как ты посмел',
                 )
+
+
+class UserStatsModelTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='stats_author')
+        cls.reader = User.objects.create_user(username='stats_reader')
+
+    def assertStats(self, user, posts, followers, following):
+        stats = UserStats.objects.get(user=user)
+        self.assertEqual(
+            (stats.posts_count, stats.followers_count, stats.following_count),
+            (posts, followers, following),
+        )
+
+    def test_stats_follow_posts_and_follows(self):
+        """Счётчики обновляются при создании и удалении постов
+        и подписок.
+        """
+        post = Post.objects.create(author=self.author, text='Пост')
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        self.assertStats(self.author, 1, 1, 0)
+        self.assertStats(self.reader, 0, 0, 1)
+        post.delete()
+        follow.delete()
+        self.assertStats(self.author, 0, 0, 0)
+        self.assertStats(self.reader, 0, 0, 0)
+
+    def test_rebuild_user_stats_command(self):
+        """Команда rebuild_user_stats пересчитывает счётчики."""
+        Post.objects.bulk_create([
+            Post(author=self.author, text='Мимо сигналов'),
+            Post(author=self.author, text='Ещё мимо сигналов'),
+        ])
+        UserStats.objects.filter(user=self.reader).delete()
+        call_command('rebuild_user_stats', stdout=StringIO())
+        self.assertStats(self.author, 2, 0, 0)
+        self.assertStats(self.reader, 0, 0, 0)
+
+
+class FollowConstraintTest(TestCase):
+    def test_follow_is_unique(self):
+        """Повторная подписка на того же автора запрещена в базе."""
+        user = User.objects.create_user(username='constraint_user')
+        author = User.objects.create_user(username='constraint_author')
+        Follow.objects.create(user=user, author=author)
+        with self.assertRaises(IntegrityError):
+            Follow.objects.create(user=user, author=author)
+
+    def test_follow_self_is_forbidden(self):
+        """Подписка на самого себя запрещена в базе."""
+        user = User.objects.create_user(username='constraint_self')
+        with self.assertRaises(IntegrityError):
+            Follow.objects.create(user=user, author=user)
+
+
+class FollowManagerTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='manager_user')
+        cls.author = User.objects.create_user(username='manager_author')
+        cls.post = Post.objects.create(author=cls.author, text='Пост')
+
+    def test_follow_is_idempotent(self):
+        """Повторная подписка не создаёт дубликатов, подписка на себя
+        невозможна, отписка возвращает новое состояние.
+        """
+        self.assertTrue(Follow.objects.follow(self.user, self.author))
+        self.assertTrue(Follow.objects.follow(self.user, self.author))
+        self.assertFalse(Follow.objects.follow(self.user, self.user))
+        self.assertEqual(Follow.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(UserStats.objects.get(
+            user=self.author
+        ).followers_count, 1)
+        self.assertFalse(Follow.objects.unfollow(self.user, self.author))
+        self.assertFalse(Follow.objects.filter(user=self.user).exists())
+
+    @mock.patch('posts.models.ID_BATCH_SIZE', 1)
+    def test_bulk_follow(self):
+        """Массовая подписка пропускает дубликаты и подписки на себя,
+        пересчитывает счётчики, заполняет ленты и сбрасывает кэш
+        профилей.
+        """
+        Follow.objects.follow(self.user, self.author)
+        pairs = [
+            (self.user.pk, self.author.pk),
+            (self.author.pk, self.user.pk),
+            (self.author.pk, self.author.pk),
+        ]
+        scope = f'profile:{self.author.username}'
+        version, = listing_versions(scope)
+        Follow.objects.bulk_follow(pairs)
+        self.assertNotEqual(listing_versions(scope), [version])
+        self.assertEqual(Follow.objects.count(), 2)
+        self.assertEqual(UserStats.objects.get(
+            user=self.author
+        ).followers_count, 1)
+        self.assertTrue(FeedItem.objects.filter(
+            user=self.user, post=self.post
+        ).exists())
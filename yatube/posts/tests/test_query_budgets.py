@@ -0,0 +1,157 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.models import Comment, Follow, Group, Post
+from ..urls import urlpatterns
+
+User = get_user_model()
+
+USERS = 50
+GROUPS = 5
+POSTS = 500
+COMMENTS = 200
+FOLLOWS = 20
+
+
+class QueryBudget:
+    """Бюджет запросов страницы: не больше queries SQL-запросов
+    и не больше seconds секунд суммарного времени SQL.
+    """
+
+    def __init__(self, queries, seconds=0.5):
+        self.queries = queries
+        self.seconds = seconds
+
+
+# Бюджет задаётся для каждого маршрута posts.urls; для страниц
+# с формой — отдельно для GET и POST. Запросы считаются с холодным
+# кэшем, то есть в худшем случае.
+BUDGETS = {
+    'index': {'get': QueryBudget(4)},
+    'group_list': {'get': QueryBudget(5)},
+    'profile': {'get': QueryBudget(6)},
+    'post_detail': {'get': QueryBudget(4)},
+    'follow_index': {'get': QueryBudget(5)},
+    'post_create': {'get': QueryBudget(3), 'post': QueryBudget(10)},
+    'post_edit': {'get': QueryBudget(4), 'post': QueryBudget(8)},
+    'add_comment': {'post': QueryBudget(5)},
+    'profile_follow': {'get': QueryBudget(11)},
+    'profile_unfollow': {'get': QueryBudget(10)},
+    'search': {'get': QueryBudget(4)},
+}
+
+
+class QueryBudgetTestCase(TestCase):
+    """Проверка бюджетов запросов (см. QueryBudget) на наборе данных
+    реалистичного размера: лишний запрос на каждую запись страницы
+    (N+1) сразу выходит за бюджет.
+    """
+
+    def assertQueryBudget(self, budget, request, *args, **kwargs):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = request(*args, **kwargs)
+        queries = context.captured_queries
+        seconds = sum(float(query['time']) for query in queries)
+        self.assertLessEqual(
+            len(queries), budget.queries,
+            'Превышен бюджет запросов:\n' + '\n'.join(
+                query['sql'] for query in queries
+            ),
+        )
+        self.assertLessEqual(
+            seconds, budget.seconds, 'Превышен бюджет времени SQL',
+        )
+        return response
+
+
+class PostsQueryBudgetTest(QueryBudgetTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        users = [
+            User.objects.create_user(username=f'budget_user_{i}')
+            for i in range(USERS)
+        ]
+        cls.user, cls.author = users[:2]
+        groups = [
+            Group.objects.create(
+                title=f'Группа {i}', slug=f'budget-{i}', description='-',
+            )
+            for i in range(GROUPS)
+        ]
+        Post.objects.bulk_create(
+            Post(
+                text=f'Пост {i}',
+                author=users[i % USERS],
+                group=groups[i % GROUPS] if i % 3 else None,
+            )
+            for i in range(POSTS)
+        )
+        cls.post = Post.objects.filter(author=cls.author).first()
+        Comment.objects.bulk_create(
+            Comment(
+                post=cls.post, author=users[i % USERS], text=f'Ответ {i}',
+            )
+            for i in range(COMMENTS)
+        )
+        for author in users[1:FOLLOWS + 1]:
+            Follow.objects.follow(cls.user, author)
+        cls.group = groups[1]
+        cls.other = users[-1]
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.user)
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+
+    def requests(self):
+        """Запросы к каждому маршруту: (имя, метод, функция, аргументы)."""
+        post_data = {'text': 'Новый текст', 'group': self.group.pk}
+        return [
+            ('index', 'get', self.client.get, reverse('posts:index')),
+            ('group_list', 'get', self.client.get,
+             reverse('posts:group_list', args=(self.group.slug,))),
+            ('profile', 'get', self.client.get,
+             reverse('posts:profile', args=(self.author.username,))),
+            ('post_detail', 'get', self.client.get,
+             reverse('posts:post_detail', args=(self.post.pk,))),
+            ('follow_index', 'get', self.client.get,
+             reverse('posts:follow_index')),
+            ('post_create', 'get', self.client.get,
+             reverse('posts:post_create')),
+            ('post_create', 'post', self.client.post,
+             reverse('posts:post_create'), post_data),
+            ('post_edit', 'get', self.author_client.get,
+             reverse('posts:post_edit', args=(self.post.pk,))),
+            ('post_edit', 'post', self.author_client.post,
+             reverse('posts:post_edit', args=(self.post.pk,)), post_data),
+            ('add_comment', 'post', self.client.post,
+             reverse('posts:add_comment', args=(self.post.pk,)),
+             {'text': 'Ещё ответ'}),
+            ('search', 'get', self.client.get, reverse('posts:search'),
+             {'q': 'пост'}),
+            ('profile_follow', 'get', self.client.get,
+             reverse('posts:profile_follow', args=(self.other.username,))),
+            ('profile_unfollow', 'get', self.client.get,
+             reverse('posts:profile_unfollow', args=(self.author.username,))),
+        ]
+
+    def test_every_url_has_budget(self):
+        """Для каждого маршрута posts.urls задан бюджет запросов."""
+        self.assertEqual(
+            set(BUDGETS), {pattern.name for pattern in urlpatterns},
+        )
+
+    def test_views_within_query_budget(self):
+        """Страницы укладываются в бюджет запросов и времени SQL."""
+        for name, method, request, *args in self.requests():
+            with self.subTest(url=name, method=method):
+                response = self.assertQueryBudget(
+                    BUDGETS[name][method], request, *args,
+                )
+                self.assertIn(response.status_code, (200, 302))
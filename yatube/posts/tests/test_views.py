@@ -1,25 +1,39 @@
+import os
 import shutil
 import tempfile
+from io import StringIO
+from unittest import mock, skipUnless
 
 from django import forms
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.files.storage import FileSystemStorage
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
 from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
-from posts.models import Group, Post, Follow, Comment
+from posts.models import Group, Post, FeedItem, Follow, Comment
 from ..constants import (POSTS_PER_PAGE,
                          POSTS_PER_PAGE_TEST,
                          TEST_POSTS_QUANTITY)
+from ..cache import ALL_LISTINGS, listing_versions, post_listing_scopes
+from ..thumbnails import (CARD_WIDTHS, MODERN_FORMATS, card_variant,
+                          generate_thumbnails, ready_thumbnail,
+                          ready_thumbnails)
+from ..search import get_backend
+from ..utils import CachedCountPaginator
 
 User = get_user_model()
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
 
-@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, POSTS_THUMBNAIL_WORKERS=0)
 class PostViewTests(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -59,6 +73,9 @@ class PostViewTests(TestCase):
         self.authorized_author = Client()
         self.authorized_author.force_login(self.author)
         cache.clear()
+        shutil.rmtree(
+            os.path.join(TEMP_MEDIA_ROOT, 'cache'), ignore_errors=True,
+        )
 
     def test_pages_uses_correct_template(self):
         """Проверяем, что view-классы используют ожидаемые
@@ -125,7 +142,7 @@ class PostViewTests(TestCase):
                 )
                 self.assertEqual(
                     context.image.name,
-                    'posts/small.gif',
+                    self.post.image.name,
                 )
                 self.assertEqual(
                     context.id,
@@ -189,6 +206,22 @@ class PostViewTests(TestCase):
             resposne.context['page_obj'][0], self.post,
         )
 
+    def test_profile_author_card_without_aggregates(self):
+        """Карточка автора на странице профиля берёт счётчики
+        из статистики пользователя, без COUNT-запросов.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.authorized_author.get(
+                reverse('posts:profile', kwargs={
+                    'username': f'{self.author.username}'
+                })
+            )
+        self.assertContains(response, 'Всего постов: 1')
+        count_queries = [
+            query['sql'] for query in queries if 'COUNT(' in query['sql']
+        ]
+        self.assertEqual(len(count_queries), 1, 'Считается только лента')
+
     def test_post_edit_page_context(self):
         """Проверяем контекст страницы редактирования поста."""
         response = self.authorized_author.get(
@@ -209,23 +242,210 @@ class PostViewTests(TestCase):
             response.context['is_edit'],
         )
 
-    def test_index_cache_20_seconds(self):
-        """Проверяем кэш."""
+    def test_index_cache(self):
+        """Главная страница берётся из кэша, пока посты не меняются,
+        и обновляется сразу после создания или удаления поста.
+        """
+        response = self.authorized_author.get(reverse('posts:index'))
+        posts = response.content
+        Post.objects.bulk_create([
+            Post(text='Мимо сигналов', author=self.author),
+        ])
+        response_cached = self.authorized_author.get(reverse('posts:index'))
+        self.assertEqual(posts, response_cached.content)
         post_cache = Post.objects.create(
             text='Тестим кеш',
             author=self.author,
             group=self.group,
         )
-        response = self.authorized_author.get(reverse('posts:index'))
-        posts = response.content
+        response_new = self.authorized_author.get(reverse('posts:index'))
+        self.assertContains(response_new, post_cache.text)
         post_cache.delete()
-        response_old = self.authorized_author.get(reverse('posts:index'))
-        old_posts = response_old.content
-        self.assertEqual(posts, old_posts)
+        response_deleted = self.authorized_author.get(reverse('posts:index'))
+        self.assertNotContains(response_deleted, post_cache.text)
+
+    @override_settings(POSTS_LISTING_CACHE_TIMEOUT=3600)
+    def test_listing_cache_not_shared_with_browsers(self):
+        """Закэшированная лента хранится только на сервере: браузеры
+        и прокси не должны отдавать её после смены версии.
+        """
+        for _ in range(2):
+            response = self.client.get(reverse('posts:index'))
+            self.assertIn('max-age=0', response['Cache-Control'])
+            self.assertFalse(response.has_header('Expires'))
+
+    def test_listing_cache_bumped_by_follow_and_group(self):
+        """Подписка сбрасывает кэш профиля автора, изменение группы —
+        кэш страницы группы.
+        """
+        profile_url = reverse('posts:profile', kwargs={
+            'username': f'{self.author.username}'
+        })
+        group_url = reverse('posts:group_list', kwargs={
+            'slug': f'{self.group.slug}'
+        })
+        self.assertContains(self.client.get(profile_url), 'Подписчиков: 0')
+        self.client.get(group_url)
+        reader = User.objects.create_user(username='CacheReader')
+        Follow.objects.follow(reader, self.author)
+        self.assertContains(self.client.get(profile_url), 'Подписчиков: 1')
+        group = Group.objects.get(pk=self.group.pk)
+        group.title = 'Новое название группы'
+        group.save()
+        self.assertContains(self.client.get(group_url), group.title)
+
+    def test_post_cards_follow_group_and_author_changes(self):
+        """Закэшированные карточки постов обновляются после смены
+        адреса группы и имени автора.
+        """
+        index_url = reverse('posts:index')
+        self.client.get(index_url)
+        self.authorized_author.get(index_url)
+        group = Group.objects.get(pk=self.group.pk)
+        group.slug = 'renamed-group'
+        group.save()
+        author = User.objects.get(pk=self.author.pk)
+        author.first_name = 'Переименованный'
+        author.save()
+        for client in (self.client, self.authorized_author):
+            with self.subTest(client=client):
+                response = client.get(index_url)
+                self.assertContains(
+                    response, reverse('posts:group_list', args=(group.slug,)),
+                )
+                self.assertContains(response, 'Переименованный')
+
+    def test_post_card_fragment_cache(self):
+        """Карточка поста кэшируется и сбрасывается при редактировании."""
+        self.client.get(reverse('posts:index'))
+        version, = listing_versions(ALL_LISTINGS)
+        key = make_template_fragment_key('post_card', [
+            self.post.pk, self.post.updated, 'posts:index', '', version,
+        ])
+        self.assertIsNotNone(cache.get(key))
+        self.authorized_author.post(
+            reverse('posts:post_edit', kwargs={'post_id': f'{self.post.id}'}),
+            data={'text': 'Отредактированный пост', 'group': self.group.pk},
+        )
+        self.assertIsNone(cache.get(key))
+        self.assertContains(
+            self.client.get(reverse('posts:index')), 'Отредактированный пост'
+        )
+
+    @override_settings(POSTS_CARD_CACHE_TIMEOUT=0)
+    def test_post_card_cache_timeout_from_settings(self):
+        """Время хранения карточки берётся из POSTS_CARD_CACHE_TIMEOUT."""
+        self.client.get(reverse('posts:index'))
+        version, = listing_versions(ALL_LISTINGS)
+        key = make_template_fragment_key('post_card', [
+            self.post.pk, self.post.updated, 'posts:index', '', version,
+        ])
+        self.assertIsNone(cache.get(key))
+
+    def test_listing_fragment_shared_between_users(self):
+        """Вошедшие пользователи получают общий закэшированный список
+        постов, а шапка страницы рисуется для каждого своя.
+        """
+        self.authorized_author.get(reverse('posts:index'))
+        Post.objects.bulk_create([
+            Post(text='Мимо сигналов', author=self.author),
+        ])
+        reader = User.objects.create_user(username='ListingReader')
+        authorized_reader = Client()
+        authorized_reader.force_login(reader)
+        with CaptureQueriesContext(connection) as queries:
+            response = authorized_reader.get(reverse('posts:index'))
+        self.assertContains(response, f'Пользователь: {reader.username}')
+        self.assertContains(response, self.post.text)
+        self.assertNotContains(response, 'Мимо сигналов')
+        self.assertFalse([
+            query for query in queries
+            if 'FROM "posts_post"' in query['sql']
+        ])
+
+    def test_thumbnail_placeholder_until_generated(self):
+        """Пока миниатюра не создана, вместо неё показывается заглушка;
+        после фоновой генерации кэш лент сбрасывается и в карточке
+        появляется миниатюра.
+        """
+        self.assertIsNone(ready_thumbnail(self.post.image))
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, 'aspect-ratio: 960 / 339')
+        generate_thumbnails(
+            self.post.image,
+            (self.post.pk, self.post.updated, self.post.group_id),
+            post_listing_scopes(self.post, [self.group.slug]),
+        )
+        thumbnail = ready_thumbnail(self.post.image)
+        self.assertIsNotNone(thumbnail)
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, thumbnail.url)
+        self.assertNotContains(response, 'aspect-ratio: 960 / 339')
+
+    def test_missing_thumbnails_scheduled_before_render(self):
+        """Недостающие миниатюры ставятся в очередь при подготовке
+        страницы, а шаблон не проверяет файлы в хранилище.
+        """
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:post_detail', args=(self.post.pk,)),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                with mock.patch(
+                    'posts.thumbnails.schedule_thumbnails',
+                ) as schedule, mock.patch.object(
+                    FileSystemStorage, 'exists',
+                ) as exists:
+                    self.client.get(url)
+                schedule.assert_called_once()
+                self.assertEqual(schedule.call_args[0][0].pk, self.post.pk)
+                exists.assert_not_called()
+
+    @skipUnless('WEBP' in MODERN_FORMATS, 'Pillow собран без WebP')
+    def test_post_picture_srcset(self):
+        """Карточка поста отдаёт варианты WebP разной ширины
+        в <picture>/srcset.
+        """
+        generate_thumbnails(
+            self.post.image, (self.post.pk, self.post.updated), [],
+        )
+        thumbnails = ready_thumbnails(self.post.image)
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, '<source type="image/webp"')
+        for width in CARD_WIDTHS:
+            with self.subTest(width=width):
+                thumbnail = thumbnails[card_variant('WEBP', width)]
+                self.assertEqual(thumbnail.width, width)
+                self.assertTrue(thumbnail.name.endswith('.webp'))
+                self.assertContains(response, f'{thumbnail.url} {width}w')
+
+    def test_page_thumbnails_resolved_in_one_query(self):
+        """Миниатюры всех постов страницы находятся одним запросом
+        к хранилищу ключей sorl.
+        """
+        second = Post.objects.create(
+            text='Второй пост с картинкой',
+            author=self.author,
+            image=SimpleUploadedFile(
+                name='second.gif',
+                content=self.post.image.open('rb').read(),
+                content_type='image/gif',
+            ),
+        )
+        for post in (self.post, second):
+            generate_thumbnails(post.image, (post.pk, post.updated), [])
+            ready_thumbnail(post.image)
         cache.clear()
-        response_new = self.authorized_author.get(reverse('posts:index'))
-        new_posts = response_new.content
-        self.assertNotEqual(old_posts, new_posts)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('posts:index'))
+        kvstore_queries = [
+            query for query in queries
+            if 'thumbnail_kvstore' in query['sql']
+        ]
+        self.assertEqual(len(kvstore_queries), 1)
+        for post in (self.post, second):
+            self.assertContains(response, ready_thumbnail(post.image).url)
 
 
 class PaginatorViewTest(TestCase):
@@ -252,6 +472,9 @@ class PaginatorViewTest(TestCase):
 
         Post.objects.bulk_create(obj)
 
+    def setUp(self):
+        cache.clear()
+
     def test_first_page_contains_ten_records(self):
         """Первая страница index содержит десять записей."""
         response = self.authorized_author.get(reverse('posts:index'))
@@ -307,6 +530,184 @@ class PaginatorViewTest(TestCase):
         )
 
 
+@override_settings(POSTS_KEYSET_PAGINATION=True)
+class KeysetPaginatorViewTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='KeysetAuthor')
+        cls.authorized_author = Client()
+        cls.authorized_author.force_login(cls.author)
+        cls.group = Group.objects.create(
+            title='Тестовая группа_keyset',
+            slug='test-slug_keyset',
+            description='Тестовое описание_keyset',
+        )
+        Post.objects.bulk_create(
+            Post(
+                text=f'Тестовый текст {i}',
+                author=cls.author,
+                group=cls.group,
+            )
+            for i in range(TEST_POSTS_QUANTITY)
+        )
+        cls.url = reverse(
+            'posts:group_list', kwargs={'slug': f'{cls.group.slug}'}
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_keyset_pages_follow_cursor(self):
+        """Курсор следующей страницы отдаёт оставшиеся записи,
+        курсор предыдущей возвращает к первой странице.
+        """
+        first_page = self.authorized_author.get(self.url).context['page_obj']
+        self.assertEqual(len(first_page), POSTS_PER_PAGE)
+        self.assertFalse(first_page.has_previous())
+        self.assertTrue(first_page.has_next())
+
+        second_page = self.authorized_author.get(
+            self.url, {'page': first_page.next_page_number()}
+        ).context['page_obj']
+        self.assertEqual(len(second_page), POSTS_PER_PAGE_TEST)
+        self.assertFalse(second_page.has_next())
+        self.assertTrue(second_page.has_previous())
+        self.assertFalse(set(first_page) & set(second_page))
+
+        back_page = self.authorized_author.get(
+            self.url, {'page': second_page.previous_page_number()}
+        ).context['page_obj']
+        self.assertEqual(list(back_page), list(first_page))
+
+    def test_keyset_last_page(self):
+        """Ссылка на последнюю страницу отдаёт самые старые записи."""
+        first_page = self.authorized_author.get(self.url).context['page_obj']
+        last_page = self.authorized_author.get(
+            self.url, {'page': first_page.paginator.num_pages}
+        ).context['page_obj']
+        self.assertEqual(
+            list(last_page),
+            list(Post.objects.filter(group=self.group).order_by(
+                '-pub_date', '-pk'
+            )[POSTS_PER_PAGE_TEST:]),
+        )
+        self.assertFalse(last_page.has_next())
+
+    def test_keyset_invalid_cursor(self):
+        """Испорченный курсор открывает первую страницу."""
+        response = self.authorized_author.get(self.url, {'page': 'broken'})
+        self.assertEqual(len(response.context['page_obj']), POSTS_PER_PAGE)
+
+
+@override_settings(POSTS_COMMENTS_PER_PAGE=POSTS_PER_PAGE)
+class CommentPaginationViewTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='Commentator')
+        cls.post = Post.objects.create(
+            text='Пост с обсуждением', author=cls.author,
+        )
+        readers = [
+            User.objects.create_user(username=f'reader_{i}')
+            for i in range(TEST_POSTS_QUANTITY)
+        ]
+        Comment.objects.bulk_create(
+            Comment(post=cls.post, author=reader, text=f'Комментарий {i}')
+            for i, reader in enumerate(readers)
+        )
+        cls.url = reverse(
+            'posts:post_detail', kwargs={'post_id': cls.post.id}
+        )
+
+    def test_comments_newest_first_by_cursor(self):
+        """Комментарии выводятся от новых к старым, курсор следующей
+        страницы отдаёт оставшиеся.
+        """
+        expected = list(
+            Comment.objects.filter(post=self.post).order_by('-created', '-pk')
+        )
+        first_page = self.client.get(self.url).context['comments']
+        self.assertEqual(list(first_page), expected[:POSTS_PER_PAGE])
+        second_page = self.client.get(
+            self.url, {'comments': first_page.next_page_number()}
+        ).context['comments']
+        self.assertEqual(list(second_page), expected[POSTS_PER_PAGE:])
+        self.assertFalse(second_page.has_next())
+
+    def test_comment_authors_not_queried_per_comment(self):
+        """Число запросов страницы поста не зависит от числа
+        комментариев.
+        """
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(self.url)
+        Comment.objects.filter(post=self.post).exclude(
+            pk=Comment.objects.filter(post=self.post).first().pk
+        ).delete()
+        with CaptureQueriesContext(connection) as one:
+            self.client.get(self.url)
+        self.assertEqual(len(many), len(one))
+
+
+class PaginatorCountCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='CountAuthor')
+        cls.group = Group.objects.create(
+            title='Тестовая группа_count',
+            slug='test-slug_count',
+            description='Тестовое описание_count',
+        )
+        cls.other_group = Group.objects.create(
+            title='Тестовая группа_count_1',
+            slug='test-slug_count_1',
+            description='Тестовое описание_count_1',
+        )
+        cls.post = Post.objects.create(
+            text='Тестовый пост_count',
+            author=cls.author,
+            group=cls.group,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def get_count(self, group):
+        return CachedCountPaginator(
+            group.posts.all(), POSTS_PER_PAGE, f'group:{group.pk}'
+        ).count
+
+    def test_count_is_cached(self):
+        """Количество постов группы берётся из кэша."""
+        self.assertEqual(self.get_count(self.group), 1)
+        Post.objects.bulk_create([
+            Post(text='Мимо сигналов', author=self.author, group=self.group)
+        ])
+        self.assertEqual(self.get_count(self.group), 1)
+
+    def test_count_invalidated_on_create_and_delete(self):
+        """Создание и удаление поста сбрасывают кэш количества."""
+        self.assertEqual(self.get_count(self.group), 1)
+        post = Post.objects.create(
+            text='Ещё пост', author=self.author, group=self.group,
+        )
+        self.assertEqual(self.get_count(self.group), 2)
+        post.delete()
+        self.assertEqual(self.get_count(self.group), 1)
+
+    def test_count_invalidated_on_group_change(self):
+        """Смена группы поста сбрасывает кэш обеих групп."""
+        self.assertEqual(self.get_count(self.group), 1)
+        self.assertEqual(self.get_count(self.other_group), 0)
+        post = Post.objects.get(pk=self.post.pk)
+        post.group = self.other_group
+        post.save()
+        self.assertEqual(self.get_count(self.group), 0)
+        self.assertEqual(self.get_count(self.other_group), 1)
+
+
 class GroupViewTest(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -524,3 +925,121 @@ class FollowViewTest(TestCase):
         self.assertNotEqual(
             response.context['page_obj'][0].id, self.postunauth.id
         )
+
+
+class FeedViewTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='FeedAuthor')
+        cls.reader = User.objects.create_user(username='FeedReader')
+        cls.old_post = Post.objects.create(
+            text='Пост до подписки', author=cls.author,
+        )
+
+    def setUp(self):
+        self.authorized_reader = Client()
+        self.authorized_reader.force_login(self.reader)
+
+    def get_feed(self):
+        response = self.authorized_reader.get(reverse('posts:follow_index'))
+        return list(response.context['page_obj'])
+
+    def test_feed_is_materialized(self):
+        """Подписка добавляет старые посты автора в ленту, новые посты
+        раскладываются по лентам, отписка очищает ленту.
+        """
+        Follow.objects.create(user=self.reader, author=self.author)
+        new_post = Post.objects.create(
+            text='Пост после подписки', author=self.author,
+        )
+        self.assertEqual(
+            FeedItem.objects.filter(user=self.reader).count(), 2
+        )
+        self.assertEqual(self.get_feed(), [new_post, self.old_post])
+        Follow.objects.filter(user=self.reader, author=self.author).delete()
+        self.assertFalse(FeedItem.objects.filter(user=self.reader).exists())
+        self.assertEqual(self.get_feed(), [])
+
+    @override_settings(POSTS_FEED_FANOUT_LIMIT=0)
+    def test_feed_pulls_popular_authors(self):
+        """Посты авторов с большим числом подписчиков не раскладываются
+        по лентам, но попадают в ленту при чтении.
+        """
+        Follow.objects.create(user=self.reader, author=self.author)
+        new_post = Post.objects.create(
+            text='Пост популярного автора', author=self.author,
+        )
+        self.assertFalse(FeedItem.objects.filter(user=self.reader).exists())
+        self.assertEqual(self.get_feed(), [new_post, self.old_post])
+
+
+class SearchViewTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # flush после TransactionTestCase не трогает таблицы индекса,
+        # и в нём могут остаться записи с id, которые займут новые посты.
+        get_backend().clear()
+        cls.author = User.objects.create_user(username='Searcher')
+        cls.text_match = Post.objects.create(
+            text='Рецепт яблочного пирога', author=cls.author,
+        )
+        cls.comment_match = Post.objects.create(
+            text='Фото с дачи', author=cls.author,
+        )
+        Comment.objects.create(
+            post=cls.comment_match, author=cls.author,
+            text='А пирог тоже испекли?',
+        )
+        cls.other = Post.objects.create(
+            text='Про погоду', author=cls.author,
+        )
+        cls.url = reverse('posts:search')
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, query, **params):
+        response = self.client.get(self.url, {'q': query, **params})
+        return response, list(response.context['page_obj'])
+
+    def test_search_ranks_posts_above_comments(self):
+        """Находятся посты по словам текста и комментариев (по началу
+        слова, без учёта регистра); совпадение в тексте поста выше.
+        """
+        _, found = self.search('ПИРОГ')
+        self.assertEqual(found, [self.text_match, self.comment_match])
+
+    def test_search_index_follows_changes(self):
+        """Индекс обновляется при изменении и удалении постов
+        и комментариев.
+        """
+        other = Post.objects.get(pk=self.other.pk)
+        other.text = 'Пирог на обед'
+        other.save()
+        Comment.objects.filter(post=self.comment_match).delete()
+        Post.objects.filter(pk=self.text_match.pk).delete()
+        _, found = self.search('пирог')
+        self.assertEqual(found, [self.other])
+
+    def test_search_paginator_keeps_query(self):
+        """Ссылки пагинатора сохраняют поисковый запрос."""
+        Post.objects.bulk_create(
+            Post(text=f'Пирог номер {i}', author=self.author)
+            for i in range(POSTS_PER_PAGE)
+        )
+        call_command('rebuild_search_index', stdout=StringIO())
+        response, found = self.search('пирог')
+        self.assertEqual(len(found), POSTS_PER_PAGE)
+        self.assertContains(
+            response, '?q=%D0%BF%D0%B8%D1%80%D0%BE%D0%B3&amp;page=2',
+        )
+        _, found = self.search('пирог', page=2)
+        self.assertEqual(len(found), 2)
+
+    def test_empty_query(self):
+        """Без запроса выводится только форма поиска."""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('page_obj', response.context)
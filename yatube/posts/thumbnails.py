@@ -0,0 +1,351 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import transaction
+from PIL import Image
+from sorl.thumbnail import default
+from sorl.thumbnail.base import EXTENSIONS as SORL_EXTENSIONS
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.helpers import serialize, tokey
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.parsers import parse_geometry
+
+from .cache import bump_listings, invalidate_post_card, post_listing_scopes
+from .image_pipeline import ImageRejected, Target, init_worker, process_image
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+# Миниатюра карточки поста в исходном формате (для <img>)
+# и её варианты в современных форматах для <picture>/srcset.
+CARD_GEOMETRY = (960, 339)
+CARD_WIDTHS = (480, 720, 960)
+CARD_OPTIONS = {'crop': 'center', 'upscale': True}
+# AVIF доступен, только если Pillow собран с его поддержкой
+# (например, с плагином pillow-avif-plugin).
+Image.init()
+MODERN_FORMATS = tuple(
+    format_ for format_ in ('AVIF', 'WEBP') if format_ in Image.SAVE
+)
+EXTENSIONS = {**SORL_EXTENSIONS, 'AVIF': 'avif'}
+
+
+def card_variant(format_, width):
+    """Имя варианта миниатюры карточки в формате format_."""
+    return f'card_{format_.lower()}_{width}'
+
+
+def _card_geometry(width):
+    card_width, card_height = CARD_GEOMETRY
+    return f'{width}x{round(width * card_height / card_width)}'
+
+
+THUMBNAIL_GEOMETRIES = {
+    'card': (_card_geometry(CARD_GEOMETRY[0]), CARD_OPTIONS),
+    **{
+        card_variant(format_, width): (
+            _card_geometry(width), {**CARD_OPTIONS, 'format': format_},
+        )
+        for format_ in MODERN_FORMATS
+        for width in CARD_WIDTHS
+    },
+}
+
+_executor = None
+_lock = threading.Lock()
+_pending = {}
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _thumbnail_file(source, geometry, options):
+    """Файл миниатюры и полные опции, с которыми её построит sorl.
+
+    Повторяет подготовку опций и имени файла из
+    ThumbnailBackend.get_thumbnail, чтобы найти или создать миниатюру
+    под тем же именем; дополнительно знает расширение AVIF.
+    """
+    backend = default.backend
+    options = dict(options)
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    key = tokey(source.key, geometry, serialize(options))
+    name = '{}{}/{}/{}.{}'.format(
+        sorl_settings.THUMBNAIL_PREFIX, key[:2], key[2:4], key,
+        EXTENSIONS[options['format']],
+    )
+    return ImageFile(name, default.storage), options
+
+
+def resolve_thumbnails(files):
+    """Находит готовые миниатюры всех размеров для многих изображений
+    одним обращением к хранилищу ключей. Отдаёт словарь
+    {имя изображения: {размер: миниатюра или None}}.
+    """
+    thumbnails = {
+        file_.name: {
+            size: _thumbnail_file(ImageFile(file_), geometry, options)[0]
+            for size, (geometry, options) in THUMBNAIL_GEOMETRIES.items()
+        }
+        for file_ in files if file_
+    }
+    found = default.kvstore.get_many(
+        thumbnail
+        for sizes in thumbnails.values()
+        for thumbnail in sizes.values()
+    )
+    return {
+        name: {
+            size: found.get(thumbnail.key)
+            for size, thumbnail in sizes.items()
+        }
+        for name, sizes in thumbnails.items()
+    }
+
+
+def warm_thumbnails(posts):
+    """Запоминает в постах их готовые миниатюры, чтобы шаблон
+    не обращался к хранилищу ради каждого поста. Создание
+    недостающих ставится в очередь.
+    """
+    thumbnails = resolve_thumbnails(
+        [post.image for post in posts if post.image]
+    )
+    for post in posts:
+        if post.image:
+            post._thumbnails = thumbnails[post.image.name]
+            if None in post._thumbnails.values():
+                schedule_thumbnails(post)
+
+
+def ready_thumbnails(file_, thumbnails=None):
+    """Готовые миниатюры изображения {размер: миниатюра или None}
+    по хранилищу ключей sorl, без обращений к файлам.
+
+    thumbnails — уже найденные resolve_thumbnails миниатюры.
+    """
+    if not file_:
+        return dict.fromkeys(THUMBNAIL_GEOMETRIES)
+    if thumbnails is None:
+        thumbnails = resolve_thumbnails([file_])[file_.name]
+    return {size: thumbnails.get(size) for size in THUMBNAIL_GEOMETRIES}
+
+
+def register_thumbnails(file_):
+    """Записывает созданные файлы миниатюр в хранилище ключей sorl:
+    только по нему шаблоны узнают, что миниатюры готовы.
+    """
+    source = ImageFile(file_)
+    default.kvstore.get_or_set(source)
+    for geometry, options in THUMBNAIL_GEOMETRIES.values():
+        thumbnail, _ = _thumbnail_file(source, geometry, options)
+        if thumbnail.exists():
+            default.kvstore.set(thumbnail, source)
+
+
+def ready_thumbnail(file_, size='card'):
+    """Готовая миниатюра размера size или None."""
+    return ready_thumbnails(file_)[size]
+
+
+def _target(geometry, options):
+    width, height = parse_geometry(geometry)
+    return Target(
+        width, height, bool(options['crop']), options['upscale'],
+        options['format'], options['quality'],
+        sorl_settings.THUMBNAIL_PROGRESSIVE,
+    )
+
+
+def _source(file_):
+    """Путь к исходнику для процесса пула; если хранилище не даёт
+    локального пути — содержимое файла.
+    """
+    try:
+        return file_.path
+    except NotImplementedError:
+        with file_.open('rb'):
+            return file_.read()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.POSTS_IMAGE_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_worker,
+                initargs=(
+                    settings.POSTS_IMAGE_MEMORY_LIMIT,
+                    settings.POSTS_IMAGE_MAX_PIXELS,
+                ),
+            )
+        return _pool
+
+
+def run_pipeline(source, targets):
+    """Строит миниатюры в пуле процессов (или в текущем потоке при
+    POSTS_IMAGE_WORKERS = 0). Упавший пул пересоздаётся при следующем
+    вызове.
+    """
+    global _pool
+    max_pixels = settings.POSTS_IMAGE_MAX_PIXELS
+    if not settings.POSTS_IMAGE_WORKERS:
+        return process_image(source, targets, max_pixels)
+    pool = _get_pool()
+    try:
+        return pool.submit(process_image, source, targets, max_pixels).result()
+    except BrokenProcessPool:
+        with _pool_lock:
+            if _pool is pool:
+                _pool = None
+        raise
+
+
+def create_thumbnails(file_):
+    """Создаёт недостающие миниатюры всех размеров одним заданием
+    пула. Базу данных не трогает, поэтому подходит для фоновых
+    потоков. Возвращает True, если что-то было создано.
+    """
+    source = ImageFile(file_)
+    missing = []
+    for geometry, options in THUMBNAIL_GEOMETRIES.values():
+        thumbnail, options = _thumbnail_file(source, geometry, options)
+        if not thumbnail.exists():
+            missing.append((thumbnail, _target(geometry, options)))
+    if not missing:
+        return False
+    results = run_pipeline(
+        _source(file_), [target for _, target in missing],
+    )
+    for (thumbnail, _), (content, size) in zip(missing, results):
+        thumbnail.write(content)
+        thumbnail.set_size(size)
+    return True
+
+
+def generate_thumbnails(image, card, scopes):
+    """Создаёт недостающие миниатюры изображения и записывает их
+    в хранилище ключей sorl. После этого сбрасывает карточку поста
+    card (аргументы invalidate_post_card) и ленты scopes,
+    закэшированные с заглушкой, а также карточки и ленты других
+    постов с тем же изображением, которые ждали этой задачи.
+    """
+    waiting = [(card, scopes)]
+    try:
+        registered = image.storage.exists(image.name)
+        if registered:
+            create_thumbnails(image)
+            register_thumbnails(image)
+    except ImageRejected as error:
+        registered = False
+        logger.warning('Изображение %s отклонено: %s', image.name, error)
+    except Exception:
+        registered = False
+        logger.exception('Не удалось создать миниатюры %s', image.name)
+    finally:
+        with _lock:
+            waiting.extend(_pending.pop(image.name, ()))
+    if registered:
+        for card, scopes in waiting:
+            invalidate_post_card(*card)
+            bump_listings(*scopes)
+
+
+def thumbnail_files(file_):
+    """Файлы миниатюр всех размеров изображения (созданные или нет)."""
+    source = ImageFile(file_)
+    return [
+        _thumbnail_file(source, geometry, options)[0]
+        for geometry, options in THUMBNAIL_GEOMETRIES.values()
+    ]
+
+
+def delete_image(file_, min_age=None):
+    """Удаляет файл изображения, все его миниатюры и записи о них
+    в хранилище ключей sorl. Файл, загруженный повторно за последние
+    min_age секунд (по умолчанию POSTS_IMAGE_REUSE_GRACE), остаётся
+    (см. storage.ContentHashStorage.discard). Возвращает, удалён ли он.
+    """
+    if min_age is None:
+        min_age = settings.POSTS_IMAGE_REUSE_GRACE
+    source = ImageFile(file_)
+    if not source.storage.discard(source.name, min_age):
+        return False
+    for thumbnail in thumbnail_files(source):
+        thumbnail.delete()
+    default.kvstore.delete(source)
+    return True
+
+
+def release_image(name):
+    """После фиксации транзакции удаляет изображение с миниатюрами,
+    если на него больше не ссылается ни один пост: одинаковые
+    загрузки хранятся одним файлом (см. storage.ContentHashStorage).
+    """
+    if not name:
+        return
+
+    def release():
+        if Post.objects.filter(image=name).exists():
+            return
+        storage = Post._meta.get_field('image').storage
+        try:
+            delete_image(ImageFile(name, storage))
+        except (OSError, SuspiciousFileOperation) as error:
+            logger.warning('Не удалось удалить %s: %s', name, error)
+
+    transaction.on_commit(release)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.POSTS_THUMBNAIL_WORKERS,
+            thread_name_prefix='thumbnails',
+        )
+    return _executor
+
+
+def schedule_thumbnails(post):
+    """Ставит создание миниатюр поста в фоновый пул после фиксации
+    транзакции. Пока задача для того же изображения не выполнена,
+    повторные вызовы только добавляют пост к ожидающим её.
+    При POSTS_THUMBNAIL_WORKERS = 0 миниатюры создаются сразу
+    в текущем потоке (в тестах задача не переживает запрос).
+    """
+    if not post.image:
+        return
+    image = post.image
+    card = (post.pk, post.updated, post.group_id)
+    group_slugs = [post.group.slug] if post.group_id else []
+    scopes = post_listing_scopes(post, group_slugs)
+
+    def submit():
+        with _lock:
+            if image.name in _pending:
+                _pending[image.name].append((card, scopes))
+                return
+            _pending[image.name] = []
+            if settings.POSTS_THUMBNAIL_WORKERS:
+                _get_executor().submit(
+                    generate_thumbnails, image, card, scopes,
+                )
+                return
+        generate_thumbnails(image, card, scopes)
+
+    transaction.on_commit(submit)
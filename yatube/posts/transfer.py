@@ -0,0 +1,331 @@
+import csv
+import json
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.management.color import no_style
+from django.db import connection
+from django.db.models import Max
+from django.utils.dateparse import parse_datetime
+
+from . import feed, search
+from .cache import ALL_LISTINGS, bump_listings, invalidate_counts
+from .models import Comment, Follow, Group, Post, User, UserStats
+from .validators import clean_text
+
+FORMATS = ('jsonl', 'csv')
+# Порядок важен: при импорте записи ссылаются на загруженные раньше.
+FIELDS = {
+    'groups': ('slug', 'title', 'description'),
+    'posts': ('id', 'author', 'group', 'text', 'pub_date', 'image'),
+    'comments': ('id', 'post', 'author', 'text', 'created'),
+    'follows': ('user', 'author'),
+}
+# Колонки values_list для выгрузки, в порядке FIELDS.
+EXPORT_COLUMNS = {
+    'groups': (Group, ('slug', 'title', 'description')),
+    'posts': (Post, (
+        'id', 'author__username', 'group__slug', 'text', 'pub_date', 'image',
+    )),
+    'comments': (Comment, (
+        'id', 'post_id', 'author__username', 'text', 'created',
+    )),
+    'follows': (Follow, ('user__username', 'author__username')),
+}
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def file_name(name, fmt):
+    return f'{name}.{fmt}'
+
+
+def export_rows(name, chunk_size):
+    """Строки выгрузки name потоком, по chunk_size записей из БД."""
+    model, columns = EXPORT_COLUMNS[name]
+    rows = model.objects.order_by('pk').values_list(*columns)
+    for row in rows.iterator(chunk_size=chunk_size):
+        yield tuple(
+            value.isoformat() if hasattr(value, 'isoformat') else value
+            for value in row
+        )
+
+
+def write_rows(file, fmt, fields, rows):
+    """Пишет строки в JSON Lines или CSV (первая строка — заголовок).
+    Возвращает количество строк.
+    """
+    total = 0
+    if fmt == 'csv':
+        writer = csv.writer(file)
+        writer.writerow(fields)
+        for row in rows:
+            writer.writerow(['' if value is None else value for value in row])
+            total += 1
+        return total
+    for row in rows:
+        file.write(json.dumps(dict(zip(fields, row)), ensure_ascii=False))
+        file.write('\n')
+        total += 1
+    return total
+
+
+def reset_sequences(*models):
+    """После вставки с явными id счётчики id таблиц нужно сдвинуть
+    (в SQLite это не требуется).
+    """
+    statements = connection.ops.sequence_reset_sql(no_style(), models)
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+def read_rows(file, fmt):
+    """Читает строки JSON Lines или CSV: (номер строки, словарь).
+    Пустые значения CSV становятся None, вместо неразобранной строки
+    отдаётся ValidationError.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, {
+                key: value if value != '' else None
+                for key, value in row.items()
+            }
+        return
+    for line, text in enumerate(file, 1):
+        if not text.strip():
+            continue
+        try:
+            yield line, json.loads(text)
+        except ValueError as error:
+            yield line, ValidationError(f'неверный JSON: {error}')
+
+
+class Importer:
+    """Загружает выгрузку export_content пачками по batch_size.
+
+    Каждая пачка проверяется целиком (clean_text для текстов, ссылки
+    на пользователей, группы и посты) и вставляется одним bulk_create.
+    Сигналы при этом не срабатывают, поэтому поиск, ленты подписок,
+    счётчики и кэш лент обновляются здесь же. Недостающие авторы
+    создаются без пароля. Строки с ошибками пропускаются, а ошибки
+    копятся в errors: откатывать ли загрузку, решает вызывающий код.
+    """
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.errors = []
+        self.user_ids = set()
+        self.group_ids = set()
+        self.author_ids = set()
+        self.backend = search.get_backend()
+
+    def load(self, name, rows):
+        """Загружает строки name; возвращает число принятых строк."""
+        load_batch = getattr(self, f'load_{name}')
+        total = 0
+        for batch in batches(self.parsed(name, rows), self.batch_size):
+            total += load_batch(batch)
+        if name in ('posts', 'comments'):
+            reset_sequences(Post if name == 'posts' else Comment)
+        if name == 'posts':
+            self.backfill_feeds()
+        return total
+
+    def finish(self):
+        """Пересчитывает счётчики пользователей и сбрасывает кэш лент."""
+        for user_ids in batches(self.user_ids, self.batch_size):
+            UserStats.objects.rebuild(user_ids)
+        invalidate_counts('index', *(
+            f'author:{user_id}' for user_id in self.user_ids
+        ), *(
+            f'group:{group_id}' for group_id in self.group_ids
+        ))
+        bump_listings(ALL_LISTINGS)
+
+    def parsed(self, name, rows):
+        """Пропускает строки, которые не разобрались в словарь."""
+        for line, row in rows:
+            if isinstance(row, ValidationError):
+                self.error(name, line, '; '.join(row.messages))
+            elif not isinstance(row, dict):
+                self.error(name, line, 'ожидался объект JSON')
+            else:
+                yield line, row
+
+    def error(self, name, line, message):
+        self.errors.append(f'{name}:{line}: {message}')
+
+    def valid(self, name, batch, check):
+        """Оставляет строки, прошедшие check; остальные попадают
+        в errors.
+        """
+        valid = []
+        for line, row in batch:
+            try:
+                check(row)
+            except ValidationError as error:
+                self.error(name, line, '; '.join(error.messages))
+            except (KeyError, ValueError, TypeError) as error:
+                self.error(name, line, f'неверное значение {error}')
+            else:
+                valid.append((line, row))
+        return valid
+
+    def users(self, usernames):
+        """id пользователей по именам; недостающие создаются."""
+        usernames = set(usernames) - {None}
+        ids = dict(User.objects.filter(
+            username__in=usernames,
+        ).values_list('username', 'pk'))
+        missing = usernames - set(ids)
+        if missing:
+            User.objects.bulk_create(
+                User(username=username, password=make_password(None))
+                for username in missing
+            )
+            ids.update(User.objects.filter(
+                username__in=missing,
+            ).values_list('username', 'pk'))
+        self.user_ids.update(ids.values())
+        return ids
+
+    def next_ids(self, model, rows):
+        """Проставляет id строкам без него — после последнего в БД."""
+        next_id = (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+        for _, row in rows:
+            if row.get('id') is None:
+                row['id'] = next_id
+                next_id += 1
+            else:
+                row['id'] = int(row['id'])
+                next_id = max(next_id, row['id'] + 1)
+
+    def load_groups(self, batch):
+        def check(row):
+            Group(
+                slug=row['slug'], title=row['title'],
+                description=row.get('description') or '',
+            ).full_clean(validate_unique=False)
+
+        batch = self.valid('groups', batch, check)
+        # Группы с уже занятым адресом остаются как есть.
+        Group.objects.bulk_create(
+            (
+                Group(
+                    slug=row['slug'], title=row['title'],
+                    description=row.get('description') or '',
+                )
+                for _, row in batch
+            ),
+            ignore_conflicts=True,
+        )
+        return len(batch)
+
+    def load_posts(self, batch):
+        groups = dict(Group.objects.filter(
+            slug__in={row['group'] for _, row in batch if row.get('group')},
+        ).values_list('slug', 'pk'))
+
+        def check(row):
+            clean_text(row['text'])
+            if row.get('author') is None:
+                raise ValidationError('не указан автор')
+            if row.get('group') and row['group'] not in groups:
+                raise ValidationError(f'нет группы {row["group"]}')
+            if parse_datetime(row['pub_date']) is None:
+                raise ValidationError(f'неверная дата {row["pub_date"]}')
+
+        batch = self.valid('posts', batch, check)
+        users = self.users(row['author'] for _, row in batch)
+        self.next_ids(Post, batch)
+        posts = [
+            Post(
+                id=row['id'],
+                author_id=users[row['author']],
+                group_id=groups[row['group']] if row.get('group') else None,
+                text=row['text'],
+                pub_date=parse_datetime(row['pub_date']),
+                image=row.get('image') or '',
+            )
+            for _, row in batch
+        ]
+        Post.objects.bulk_create(posts)
+        # bulk_create ставит pub_date текущим временем (auto_now_add),
+        # поэтому исходные даты записываются отдельным UPDATE.
+        for post, (_, row) in zip(posts, batch):
+            post.pub_date = parse_datetime(row['pub_date'])
+        Post.objects.bulk_update(posts, ['pub_date'])
+        self.backend.index_posts(posts)
+        self.group_ids.update(post.group_id for post in posts)
+        self.group_ids.discard(None)
+        self.author_ids.update(post.author_id for post in posts)
+        return len(posts)
+
+    def backfill_feeds(self):
+        """Добавляет новые посты в ленты уже существующих подписчиков."""
+        follows = Follow.objects.filter(
+            author_id__in=self.author_ids,
+        ).values_list('user_id', 'author_id')
+        for user_id, author_id in follows.iterator(chunk_size=self.batch_size):
+            feed.backfill(user_id, author_id)
+
+    def load_comments(self, batch):
+        posts = set(Post.objects.filter(pk__in={
+            int(row['post']) for _, row in batch
+            if str(row.get('post')).isdigit()
+        }).values_list('pk', flat=True))
+
+        def check(row):
+            clean_text(row['text'])
+            if row.get('author') is None:
+                raise ValidationError('не указан автор')
+            if int(row['post']) not in posts:
+                raise ValidationError(f'нет поста {row["post"]}')
+            if parse_datetime(row['created']) is None:
+                raise ValidationError(f'неверная дата {row["created"]}')
+
+        batch = self.valid('comments', batch, check)
+        users = self.users(row['author'] for _, row in batch)
+        self.next_ids(Comment, batch)
+        comments = [
+            Comment(
+                id=row['id'],
+                post_id=int(row['post']),
+                author_id=users[row['author']],
+                text=row['text'],
+            )
+            for _, row in batch
+        ]
+        Comment.objects.bulk_create(comments)
+        for comment, (_, row) in zip(comments, batch):
+            comment.created = parse_datetime(row['created'])
+        Comment.objects.bulk_update(comments, ['created'])
+        self.backend.index_comments(comments)
+        return len(comments)
+
+    def load_follows(self, batch):
+        def check(row):
+            if not row.get('user') or not row.get('author'):
+                raise ValidationError('не указан пользователь')
+
+        batch = self.valid('follows', batch, check)
+        users = self.users(
+            username for _, row in batch
+            for username in (row['user'], row['author'])
+        )
+        return Follow.objects.bulk_follow(
+            (
+                (users[row['user']], users[row['author']])
+                for _, row in batch
+            ),
+        )
@@ -0,0 +1,141 @@
+import hashlib
+import io
+import os
+import tempfile
+from functools import wraps
+
+from django.conf import settings
+from django.core.files.uploadedfile import (TemporaryUploadedFile,
+                                            UploadedFile)
+from django.core.files.uploadhandler import (FileUploadHandler,
+                                             StopFutureHandlers)
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+
+from .image_pipeline import ImageRejected, open_image
+from .models import Post
+
+# Сколько байт начала файла можно накопить, пока Pillow не сможет
+# прочитать заголовок (JPEG с крупными EXIF и ICC-профилем).
+HEADER_LIMIT = 1024 * 1024
+
+
+class StreamedImage(TemporaryUploadedFile):
+    """Загруженное изображение во временном файле рядом с местом
+    хранения: при сохранении файл переносится переименованием, а
+    ImageField проверяет его по пути, не читая в память.
+
+    Помимо файла хранит SHA-256 содержимого (sha256) или код ошибки
+    (error), если изображение отклонено.
+    """
+
+    def __init__(self, name, content_type, charset, content_type_extra,
+                 directory):
+        file = tempfile.NamedTemporaryFile(prefix='.upload-', dir=directory)
+        UploadedFile.__init__(
+            self, file, name, content_type, 0, charset, content_type_extra,
+        )
+        self.sha256 = None
+        self.error = None
+
+
+class ImageUploadHandler(FileUploadHandler):
+    """Принимает файл поля field_name потоком: считает размер и хэш
+    по мере поступления, проверяет заголовок изображения по первым
+    байтам и пишет содержимое сразу в каталог хранилища. Файл больше
+    POSTS_IMAGE_MAX_SIZE или не изображение дальше не записывается,
+    остаток запроса отбрасывается.
+    """
+
+    def __init__(self, request=None, field_name='image'):
+        super().__init__(request)
+        self.field_name = field_name
+        self.upload = None
+
+    def directory(self):
+        field = Post._meta.get_field(self.field_name)
+        try:
+            directory = field.storage.path(field.upload_to)
+        except NotImplementedError:
+            return settings.FILE_UPLOAD_TEMP_DIR
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        if field_name != self.field_name:
+            self.upload = None
+            return
+        self.upload = StreamedImage(
+            self.file_name, self.content_type, self.charset,
+            self.content_type_extra, self.directory(),
+        )
+        self.digest = hashlib.sha256()
+        self.header = bytearray()
+        if (self.content_length or 0) > settings.POSTS_IMAGE_MAX_SIZE:
+            self.reject('file_too_large')
+        raise StopFutureHandlers()
+
+    def reject(self, error):
+        self.upload.error = error
+        self.upload.close()
+        self.header = None
+
+    def check_header(self, final=False):
+        try:
+            open_image(
+                io.BytesIO(self.header), settings.POSTS_IMAGE_MAX_PIXELS,
+            ).close()
+        except (ImageRejected, OSError, SyntaxError, EOFError, ValueError):
+            # Плагины Pillow сообщают о битом или неполном заголовке
+            # не только UnidentifiedImageError.
+            if final or len(self.header) >= HEADER_LIMIT:
+                self.reject('invalid_image')
+            return
+        self.header = None
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.upload is None:
+            return raw_data
+        if self.upload.error:
+            return None
+        if start + len(raw_data) > settings.POSTS_IMAGE_MAX_SIZE:
+            self.reject('file_too_large')
+            return None
+        if self.header is not None:
+            self.header += raw_data
+            self.check_header()
+            if self.upload.error:
+                return None
+        self.digest.update(raw_data)
+        self.upload.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if self.upload is None:
+            return None
+        if not self.upload.error and self.header is not None:
+            self.check_header(final=True)
+        upload, self.upload = self.upload, None
+        if upload.error:
+            return upload
+        upload.size = file_size
+        upload.sha256 = self.digest.hexdigest()
+        upload.seek(0)
+        return upload
+
+    def upload_interrupted(self):
+        if self.upload is not None:
+            self.upload.close()
+
+
+def stream_image_uploads(view):
+    """Подключает ImageUploadHandler к view. Обработчики загрузки
+    можно менять только до чтения request.POST, а его читает
+    CsrfViewMiddleware, поэтому CSRF проверяется уже после замены.
+    """
+    @csrf_exempt
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        request.upload_handlers.insert(0, ImageUploadHandler(request))
+        return csrf_protect(view)(request, *args, **kwargs)
+    return wrapper
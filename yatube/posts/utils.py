@@ -1,18 +1,311 @@
-from django.core.paginator import Paginator
+import binascii
 
+from django.conf import settings
+from django.core.paginator import Page, Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.utils.dateparse import parse_datetime
+from django.utils.encoding import force_bytes, force_text
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+
+from .cache import get_cached_count
 from .constants import POSTS_PER_PAGE
+from .thumbnails import warm_thumbnails
+
+CURSOR_NEXT = 'n'
+CURSOR_PREVIOUS = 'p'
+CURSOR_LAST = 'l'
+
+
+def encode_cursor(direction, value=None, pk=None):
+    """Упаковывает направление и ключ (значение поля, id) в непрозрачный
+    токен, пригодный для передачи в URL.
+    """
+    raw = direction
+    if value is not None:
+        raw = f'{direction}|{value.isoformat()}|{pk}'
+    return urlsafe_base64_encode(force_bytes(raw))
+
+
+def decode_cursor(token):
+    """Распаковывает токен курсора. Для пустого или испорченного
+    токена возвращает None, что означает первую страницу.
+    """
+    if not token:
+        return None
+    try:
+        raw = force_text(urlsafe_base64_decode(token))
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        return None
+    if raw == CURSOR_LAST:
+        return CURSOR_LAST, None, None
+    parts = raw.split('|')
+    if len(parts) != 3 or parts[0] not in (CURSOR_NEXT, CURSOR_PREVIOUS):
+        return None
+    direction, value, pk = parts
+    value = parse_datetime(value)
+    if value is None or not pk.isdigit():
+        return None
+    return direction, value, int(pk)
+
+
+class KeysetPage(Page):
+    """Страница курсорной пагинации.
+
+    Повторяет интерфейс Page, который использует paginator.html:
+    вместо номеров соседних страниц отдаёт токены курсоров.
+    Токены вычисляются при создании страницы, поэтому object_list
+    можно подменить, например, на связанные объекты.
+    """
+
+    def __init__(self, object_list, paginator, previous_cursor, next_cursor):
+        super().__init__(object_list, None, paginator)
+        self.previous_cursor = previous_cursor
+        self.next_cursor = next_cursor
+
+    def __repr__(self):
+        return '<Keyset page>'
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def next_page_number(self):
+        return self.next_cursor
+
+    def previous_page_number(self):
+        return self.previous_cursor
+
+
+class KeysetPaginator(Paginator):
+    """Курсорная (keyset) пагинация по ключу (field, id).
+
+    Не выполняет COUNT(*) и OFFSET: каждая страница выбирается
+    диапазонным запросом по индексу от ключа соседней записи.
+    Общее число страниц неизвестно, поэтому page_range пуст,
+    а num_pages отдаёт токен перехода на последнюю страницу.
+    """
+
+    def __init__(self, object_list, per_page, field='pub_date', **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.field = field
+
+    @property
+    def num_pages(self):
+        return encode_cursor(CURSOR_LAST)
+
+    @property
+    def page_range(self):
+        return range(0)
+
+    def _ordered(self, descending):
+        prefix = '-' if descending else ''
+        return self.object_list.order_by(
+            f'{prefix}{self.field}', f'{prefix}pk'
+        )
+
+    def _seek(self, cursor):
+        """Возвращает срез записей страницы (с одной лишней записью)
+        и признак того, что курсор сдвинут с первой страницы.
+        """
+        limit = self.per_page + 1
+        if cursor is None:
+            return self._ordered(descending=True)[:limit], False
+        direction, value, pk = cursor
+        if direction == CURSOR_LAST:
+            return self._ordered(descending=False)[:limit], True
+        if direction == CURSOR_NEXT:
+            lookup = 'lt'
+            queryset = self._ordered(descending=True)
+        else:
+            lookup = 'gt'
+            queryset = self._ordered(descending=False)
+        queryset = queryset.filter(
+            Q(**{f'{self.field}__{lookup}': value})
+            | Q(**{self.field: value, f'pk__{lookup}': pk})
+        )
+        return queryset[:limit], True
+
+    def _cursor(self, direction, row):
+        return encode_cursor(direction, getattr(row, self.field), row.pk)
+
+    def page(self, token):
+        cursor = decode_cursor(token)
+        rows, moved = self._seek(cursor)
+        rows = list(rows)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if cursor is not None and cursor[0] != CURSOR_NEXT:
+            rows.reverse()
+            has_previous = has_more
+            has_next = cursor[0] == CURSOR_PREVIOUS
+        else:
+            has_previous = moved
+            has_next = has_more
+        previous_cursor = next_cursor = None
+        if rows and has_previous:
+            previous_cursor = self._cursor(CURSOR_PREVIOUS, rows[0])
+        if rows and has_next:
+            next_cursor = self._cursor(CURSOR_NEXT, rows[-1])
+        return KeysetPage(rows, self, previous_cursor, next_cursor)
+
+    def get_page(self, token):
+        return self.page(token)
+
+
+def estimate_count(queryset):
+    """Оценка количества записей по плану запроса PostgreSQL.
+
+    Для остальных СУБД оценки нет — возвращает None.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def large_estimate(queryset):
+    """Оценка планировщика, если задан POSTS_COUNT_ESTIMATE_THRESHOLD
+    и выборка больше порога; иначе None.
+    """
+    threshold = settings.POSTS_COUNT_ESTIMATE_THRESHOLD
+    if threshold is None:
+        return None
+    estimate = estimate_count(queryset)
+    if estimate is not None and estimate >= threshold:
+        return estimate
+    return None
+
+
+def count_or_estimate(queryset):
+    """COUNT(*) выборки или, если задан POSTS_COUNT_ESTIMATE_THRESHOLD
+    и выборка больше порога, оценка планировщика.
+    """
+    estimate = large_estimate(queryset)
+    if estimate is not None:
+        return estimate
+    return queryset.count()
+
+
+class CachedCountPaginator(Paginator):
+    """Paginator, который берёт общее количество записей из кэша.
+
+    Кэш хранится по ленте (scope) и сбрасывается сигналами
+    при создании, удалении и смене группы поста. Если задана настройка
+    POSTS_COUNT_ESTIMATE_THRESHOLD, для лент больше этого порога
+    используется оценка планировщика вместо точного COUNT(*).
+    """
+
+    def __init__(self, object_list, per_page, scope, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.scope = scope
+
+    def _count(self):
+        return count_or_estimate(self.object_list)
+
+    @cached_property
+    def count(self):
+        return get_cached_count(self.scope, self._count)
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator без кэша для выборок с произвольными фильтрами,
+    например в админке. Большие выборки считаются приблизительно:
+    по оценке планировщика (см. POSTS_COUNT_ESTIMATE_THRESHOLD),
+    а без неё (в SQLite или без порога) — не дальше
+    POSTS_ADMIN_COUNT_LIMIT записей после страницы page. Таблица
+    не сканируется целиком, а ссылки на следующие страницы остаются.
+
+    approximate — количество неточное: оценка (estimated) или
+    нижняя граница (capped).
+    """
+
+    def __init__(self, object_list, per_page, orphans=0,
+                 allow_empty_first_page=True, page=1):
+        super().__init__(
+            object_list, per_page, orphans, allow_empty_first_page,
+        )
+        self.page_number = page
+        self.approximate = None
+
+    @cached_property
+    def count(self):
+        estimate = large_estimate(self.object_list)
+        if estimate is not None:
+            self.approximate = 'estimated'
+            return estimate
+        limit = settings.POSTS_ADMIN_COUNT_LIMIT
+        if limit is None:
+            return self.object_list.count()
+        limit += self.page_number * self.per_page
+        count = self.object_list.order_by()[:limit + 1].count()
+        if count > limit:
+            self.approximate = 'capped'
+            return limit
+        return count
+
+
+class PagePosts:
+    """Посты страницы, которые загружаются при первом обращении.
+
+    Вместе с постами одним обращением к хранилищу находятся их
+    миниатюры. Если список не понадобился (фрагмент ленты взят
+    из кэша), запросов нет вовсе. unwrap достаёт пост из записи
+    страницы, например из записи ленты подписок.
+    """
+
+    def __init__(self, object_list, unwrap=None):
+        self.object_list = object_list
+        self.unwrap = unwrap
+
+    @cached_property
+    def posts(self):
+        posts = list(self.object_list)
+        if self.unwrap is not None:
+            posts = [self.unwrap(item) for item in posts]
+        warm_thumbnails(posts)
+        return posts
+
+    def __len__(self):
+        return len(self.posts)
+
+    def __iter__(self):
+        return iter(self.posts)
+
+    def __getitem__(self, index):
+        return self.posts[index]
 
 
-def get_page(posts, request):
+def get_page(posts, request, keyset=None, count_scope=None, unwrap=None):
     """Функция отдаёт количество постов на страницу, указанное
     в константе POSTS_PET_PAGE,
     paginator определяет количество записей на странице,
     page_number извлекает из URL номер запрошенной страницы,
     page_obj получает набор записей для страницы
     с запрошенным номером.
+    При keyset=True (по умолчанию — настройка POSTS_KEYSET_PAGINATION)
+    в параметре page передаётся токен курсора, а не номер страницы.
+    count_scope задаёт ленту, общее количество постов которой
+    берётся из кэша (index, group:<id>, author:<id>).
+    Посты страницы и их миниатюры загружаются лениво (см. PagePosts).
     """
-    paginator = Paginator(posts, POSTS_PER_PAGE)
+    if keyset is None:
+        keyset = settings.POSTS_KEYSET_PAGINATION
+    if keyset:
+        paginator = KeysetPaginator(posts, POSTS_PER_PAGE)
+    elif count_scope is not None:
+        paginator = CachedCountPaginator(posts, POSTS_PER_PAGE, count_scope)
+    else:
+        paginator = Paginator(posts, POSTS_PER_PAGE)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
+    page_obj.object_list = PagePosts(page_obj.object_list, unwrap)
 
     return {'page_obj': page_obj}
@@ -1,13 +1,20 @@
+from urllib.parse import urlencode
+
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import get_object_or_404, redirect, render
-from django.views.decorators.cache import cache_page
 
+from .cache import cache_listing, invalidate_post_card
+from .feed import get_feed, unwrap_post
 from .forms import PostForm, CommentForm
-from .models import Group, Post, User, Comment, Follow
-from .utils import get_page
+from .models import Group, Post, User, UserStats, Comment, Follow
+from .search import SearchResults
+from .thumbnails import schedule_thumbnails, warm_thumbnails
+from .uploads import stream_image_uploads
+from .utils import KeysetPaginator, get_page
 
 
-@cache_page(20, key_prefix="index_page")
+@cache_listing(lambda: 'index')
 def index(request):
     """Забирает из баззы данных и возвращает на главную
     страницу информацию о последних постах на сайте,
@@ -15,11 +22,12 @@ def index(request):
     """
     template = 'posts/index.html'
     posts = Post.objects.select_related('author', 'group')
-    context = get_page(posts, request)
+    context = get_page(posts, request, count_scope='index')
 
     return render(request, template, context)
 
 
+@cache_listing(lambda slug: f'group:{slug}')
 def group_posts(request, slug):
     """Забирает из баззы данных информацию о постах,
     относящихся к определённой группе, заголовок и
@@ -31,14 +39,18 @@ def group_posts(request, slug):
     context = {
         'group': group,
     }
-    context.update(get_page(posts, request))
+    context.update(get_page(posts, request, count_scope=f'group:{group.pk}'))
 
     return render(request, template, context)
 
 
+@cache_listing(lambda username: f'profile:{username}')
 def profile(request, username):
     """Отображает информацию о профиле пользовалтеля."""
-    author = get_object_or_404(User, username=username)
+    author = get_object_or_404(
+        User.objects.select_related('stats'), username=username
+    )
+    UserStats.objects.for_user(author)
     posts = author.posts.select_related('author', 'group')
     following = request.user.is_authenticated and author.following.filter(
         user=request.user
@@ -48,7 +60,9 @@ def profile(request, username):
         'author': author,
         'following': following,
     }
-    context.update(get_page(posts, request))
+    context.update(
+        get_page(posts, request, count_scope=f'author:{author.pk}')
+    )
 
     return render(request, template, context)
 
@@ -56,10 +70,16 @@ def profile(request, username):
 def post_detail(request, post_id):
     """Отображает информацию о деталях конкретного поста пользователя."""
     post = get_object_or_404(
-        Post.objects.select_related('author', 'group'), pk=post_id
+        Post.objects.select_related('author__stats', 'group'), pk=post_id
     )
+    UserStats.objects.for_user(post.author)
+    warm_thumbnails([post])
     form = CommentForm(request.POST or None)
-    comments = Comment.objects.filter(post__pk=post_id)
+    comments = KeysetPaginator(
+        Comment.objects.filter(post=post).select_related('author'),
+        settings.POSTS_COMMENTS_PER_PAGE,
+        field='created',
+    ).get_page(request.GET.get('comments'))
     context = {
         'post': post,
         'form': form,
@@ -70,6 +90,7 @@ def post_detail(request, post_id):
 
 
 @login_required
+@stream_image_uploads
 def post_create(request):
     """Позволяет создать новый пост и сохраняет его в базу данных."""
     form = PostForm(request.POST or None, files=request.FILES or None)
@@ -78,6 +99,7 @@ def post_create(request):
         post = form.save(commit=False)
         post.author = request.user
         post.save()
+        schedule_thumbnails(post)
 
         return redirect('posts:profile', post.author)
 
@@ -85,6 +107,7 @@ def post_create(request):
 
 
 @login_required
+@stream_image_uploads
 def post_edit(request, post_id):
     """Позволяет отредактировать уже существующий пост."""
     post = get_object_or_404(
@@ -94,6 +117,7 @@ def post_edit(request, post_id):
 
         return redirect('posts:post_detail', post_id)
 
+    updated, group_id = post.updated, post.group_id
     form = PostForm(
         request.POST or None,
         instance=post,
@@ -104,6 +128,8 @@ def post_edit(request, post_id):
         post = form.save(commit=False)
         post.author = request.user
         form.save()
+        invalidate_post_card(post.pk, updated, group_id)
+        schedule_thumbnails(post)
 
         return redirect('posts:post_detail', post_id)
 
@@ -126,11 +152,23 @@ def add_comment(request, post_id):
     return redirect('posts:post_detail', post_id=post_id)
 
 
+def search(request):
+    """Ищет посты по словам из текста постов и комментариев,
+    самые релевантные выводятся первыми.
+    """
+    query = request.GET.get('q', '').strip()
+    context = {'query': query}
+    if query:
+        context.update(get_page(SearchResults(query), request, keyset=False))
+        context['page_query'] = urlencode({'q': query}) + '&'
+
+    return render(request, 'posts/search.html', context)
+
+
 @login_required
 def follow_index(request):
     """Позволяет отслеживать избранных авторов."""
-    posts = Post.objects.filter(author__following__user=request.user)
-    context = get_page(posts, request)
+    context = get_page(get_feed(request.user), request, unwrap=unwrap_post)
 
     return render(request, 'posts/follow.html', context)
 
@@ -139,16 +177,7 @@ def follow_index(request):
 def profile_follow(request, username):
     """Позволяет подписаться на автора."""
     author = get_object_or_404(User, username=username)
-    if (
-        request.user == author
-        or Follow.objects.filter(
-            user=request.user, author=author
-        ).exists()
-    ):
-
-        return redirect('posts:profile', username=username)
-
-    Follow.objects.create(user=request.user, author=author)
+    Follow.objects.follow(request.user, author)
 
     return redirect('posts:profile', username=username)
 
@@ -156,8 +185,7 @@ def profile_follow(request, username):
 @login_required
 def profile_unfollow(request, username):
     """Позволяет отписаться от автора."""
-    Follow.objects.filter(
-        user=request.user, author__username=username
-    ).delete()
+    author = get_object_or_404(User, username=username)
+    Follow.objects.unfollow(request.user, author)
 
     return redirect('posts:profile', username=username)
@@ -11,6 +11,9 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+import tempfile
+
+from core.caches import cache_settings
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -50,6 +53,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -145,10 +149,120 @@ CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Бэкенд кэша выбирается переменными окружения CACHE_BACKEND
+# (locmem, file, db, memcached, redis) и CACHE_LOCATION.
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'locmem')
+CACHE_LOCATION = os.getenv('CACHE_LOCATION')
+if CACHE_BACKEND == 'file' and not CACHE_LOCATION:
+    CACHE_LOCATION = os.path.join(tempfile.gettempdir(), 'yatube_cache')
+
 CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+    'default': cache_settings(
+        CACHE_BACKEND,
+        CACHE_LOCATION,
+        key_prefix=os.getenv('CACHE_KEY_PREFIX', 'yatube'),
+    ),
 }
 
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
+
+# Сигналы сбрасывают кэш лент и количеств постов только в том кэше,
+# который видит процесс. locmem у каждого процесса свой, поэтому
+# с ним остальные процессы веб-сервера видят изменения лишь по
+# истечении таймаута — для locmem таймауты держатся короткими,
+# длинные включаются только с общим бэкендом (file, db, memcached,
+# redis).
+CACHE_SHARED = CACHE_BACKEND != 'locmem'
+
+# Курсорная пагинация лент вместо номеров страниц (без COUNT и OFFSET).
+POSTS_KEYSET_PAGINATION = False
+
+# Время жизни закэшированного количества постов в лентах (сбрасывается
+# сигналами при изменении постов) и порог, начиная с которого
+# используется оценка планировщика вместо COUNT(*); None — не оценивать.
+POSTS_COUNT_CACHE_TIMEOUT = 60 * 60 * 24 if CACHE_SHARED else 20
+POSTS_COUNT_ESTIMATE_THRESHOLD = None
+
+# Список постов в админке считает не больше POSTS_ADMIN_COUNT_LIMIT
+# записей после текущей страницы, если нет оценки планировщика,
+# и показывает количество как «N+»; None — считать все.
+POSTS_ADMIN_COUNT_LIMIT = 10000
+
+# Комментарии к посту выводятся от новых к старым страницами
+# по POSTS_COMMENTS_PER_PAGE с курсорной пагинацией.
+POSTS_COMMENTS_PER_PAGE = 20
+
+# Лента подписок: посты авторов, у которых подписчиков больше
+# POSTS_FEED_FANOUT_LIMIT, не раскладываются по лентам, а подтягиваются
+# при чтении; при подписке в ленту добавляются POSTS_FEED_BACKFILL
+# последних постов автора.
+POSTS_FEED_FANOUT_LIMIT = 10000
+POSTS_FEED_BACKFILL = 1000
+POSTS_FEED_BATCH_SIZE = 1000
+
+# Страницы лент кэшируются до изменения постов, групп или подписок;
+# с общим кэшем таймаут лишь ограничивает срок хранения, с locmem —
+# ещё и время, когда другие процессы показывают устаревшие ленты.
+POSTS_LISTING_CACHE_TIMEOUT = 60 * 60 if CACHE_SHARED else 20
+
+# Карточки постов (posts/includes/post_card.html) кэшируются так же:
+# с locmem другие процессы не узнают о переименовании автора или группы
+# и о готовых миниатюрах, пока карточка не истечёт.
+POSTS_CARD_CACHE_TIMEOUT = 60 * 60 * 24 if CACHE_SHARED else 20
+
+# Миниатюры изображений постов создаются в фоновом пуле потоков
+# после сохранения поста; до готовности шаблоны показывают заглушку.
+# 0 — создавать сразу в потоке запроса (так работают тесты, чтобы
+# задачи не писали в MEDIA_ROOT после окончания теста).
+POSTS_THUMBNAIL_WORKERS = int(os.getenv('POSTS_THUMBNAIL_WORKERS', 2))
+
+# Изображения обрабатываются в пуле из POSTS_IMAGE_WORKERS процессов
+# (0 — в фоновом потоке веб-процесса). Изображения больше
+# POSTS_IMAGE_MAX_PIXELS пикселей отклоняются до декодирования,
+# память процесса пула ограничена POSTS_IMAGE_MEMORY_LIMIT байтами
+# (None — без ограничения).
+POSTS_IMAGE_WORKERS = 2
+POSTS_IMAGE_MAX_PIXELS = 50 * 1000 * 1000
+POSTS_IMAGE_MEMORY_LIMIT = 1024 * 1024 * 1024
+
+# Загружаемые изображения принимаются потоком сразу в каталог
+# хранилища; файлы больше POSTS_IMAGE_MAX_SIZE байт отклоняются,
+# как только поступит лишний байт. Перенесённый в хранилище временный
+# файл получает права FILE_UPLOAD_PERMISSIONS.
+POSTS_IMAGE_MAX_SIZE = 10 * 1024 * 1024
+
+# Одинаковые загрузки хранятся одним файлом. Повторная загрузка
+# обновляет время изменения файла, и пост, ссылка на который ещё
+# не зафиксирована, защищён от удаления файла на
+# POSTS_IMAGE_REUSE_GRACE секунд: столько же по умолчанию ждёт
+# collect_media_garbage.
+POSTS_IMAGE_REUSE_GRACE = 60 * 60
+FILE_UPLOAD_PERMISSIONS = 0o644
+
+# Полнотекстовый поиск (/search/): индекс SQLite FTS5, для других
+# СУБД — posts.search.DatabaseBackend (LIKE без индекса), так как
+# таблицы индекса миграция создаёт только в SQLite. Совпадения
+# в комментариях весят POSTS_SEARCH_COMMENT_WEIGHT от совпадений
+# в тексте поста.
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    POSTS_SEARCH_BACKEND = 'posts.search.SQLiteFTSBackend'
+else:
+    POSTS_SEARCH_BACKEND = 'posts.search.DatabaseBackend'
+POSTS_SEARCH_COMMENTS = True
+POSTS_SEARCH_COMMENT_WEIGHT = 0.5
+
+# Замеры запросов (SQL, шаблоны, общее время) для доли запросов
+# INSTRUMENTATION_SAMPLE_RATE от 0 (выключено) до 1: гистограммы
+# отдаются по /metrics/ в формате Prometheus сотрудникам и по токену
+# INSTRUMENTATION_METRICS_TOKEN (Authorization: Bearer <токен>; без
+# токена — только сотрудникам), замер запроса — в заголовке
+# Server-Timing.
+INSTRUMENTATION_SAMPLE_RATE = float(
+    os.getenv('INSTRUMENTATION_SAMPLE_RATE', 0)
+)
+INSTRUMENTATION_METRICS_TOKEN = os.getenv('INSTRUMENTATION_METRICS_TOKEN')
+INSTRUMENTATION_SERVER_TIMING = True
+
+# Хранилище ключей sorl-thumbnail с пакетным чтением: миниатюры
+# страницы ленты находятся одним запросом.
+THUMBNAIL_KVSTORE = 'posts.kvstore.KVStore'